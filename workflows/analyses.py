@@ -0,0 +1,215 @@
+"""Per-sample analyses that work on an already loaded community."""
+
+from os import remove
+from os.path import isfile
+import numpy as np
+import pandas as pd
+import micom
+from cobra.exceptions import OptimizationError
+from micom.media import minimal_medium
+from media_cache import load_medium, media_key, save_medium
+from metrics import phase
+from model_store import load_taxa
+from reduction import expand_fluxes
+from solving import knockout_taxa, tradeoff_sweep, warm_start
+
+logger = micom.logger.logger
+
+
+def tradeoff_grid(step=0.1):
+    """Get evenly spaced tradeoff values in (0, 1]."""
+    return np.arange(step, 1.0 + step / 10, step)
+
+
+tradeoffs = tradeoff_grid()
+
+
+def tradeoff_rates(com, sam, tradeoffs=tradeoffs):
+    """Get growth rates for the unconstrained and tradeoff solutions."""
+    with phase("tradeoff", sam, com):
+        sol = tradeoff_sweep(com, tradeoffs, include_max=True)
+    with phase("tradeoff_table", sam):
+        df = []
+        for i, s in enumerate(sol.solution):
+            rates = s.members
+            rates["tradeoff"] = sol.tradeoff[i]
+            rates["sample"] = sam
+            df.append(rates)
+        df = pd.concat(df)
+    return df
+
+
+def media_and_gcs(com, sam, cache=None):
+    """Get growth rates, the minimal medium and fluxes on that medium.
+
+    All problems are solved in the same solver session. The tradeoff
+    solution is feasible for the minimal medium problem and the minimal
+    medium solution is feasible on that medium, so every step can start
+    from the optimal basis of the previous one.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community to use.
+    sam : str
+        The sample name.
+    cache : str, optional
+        A directory with cached minimal media (see `media_cache.py`). Cached
+        media are only reused for communities with exactly the same taxa,
+        abundances, diet and required growth rate.
+    """
+    with com, warm_start(com):
+        # Get growth rates
+        with phase("growth_rates", sam, com):
+            sol = tradeoff_sweep(com, [0.5]).solution.iloc[0]
+            rates = sol.members["growth_rate"].copy()
+            rates["community"] = sol.growth_rate
+            rates.name = sam
+
+        # Get the minimal medium, starting from the tradeoff solution
+        with phase("minimal_medium", sam, com):
+            growth = 0.95 * sol.growth_rate
+            key = None if cache is None else media_key(com, growth)
+            med = None if cache is None else load_medium(key, cache)
+            if med is None:
+                med = minimal_medium(com, growth, exports=True)
+                if med is not None and cache is not None:
+                    save_medium(key, med, cache)
+        if med is None:
+            raise OptimizationError(
+                "could not get a minimal medium for %s." % sam
+            )
+        med.name = sam
+
+        # Apply medium and reoptimize, the context restores the original
+        # medium
+        with com, phase("medium_fluxes", sam, com):
+            com.medium = med[med > 0]
+            sol = tradeoff_sweep(com, [0.5], fluxes=True).solution.iloc[0]
+    with phase("flux_table", sam):
+        fluxes = expand_fluxes(com, sol.fluxes)
+        fluxes["sample"] = sam
+    return {"medium": med, "gcs": rates, "fluxes": fluxes}
+
+
+def diet_scan(com, sam, diets, fraction=0.5):
+    """Get growth rates and exchange fluxes on many diets.
+
+    The diets are applied to the community one after the other in the same
+    solver session, so every solve starts from the optimal basis of the
+    previous diet. Diets that do not allow any growth are skipped.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community to use.
+    sam : str
+        The sample name.
+    diets : pandas.DataFrame
+        The diets with one row per diet and one column per exchange
+        reaction in the medium compartment. Missing values mean the
+        metabolite is not in the diet.
+    fraction : float in [0, 1]
+        The tradeoff value.
+
+    Returns
+    -------
+    dict
+        Long tables of the "growth_rates" with the columns "sample", "diet",
+        "compartment" and "growth_rate" and the non-zero "exchanges" with
+        the columns "sample", "diet", "compartment", "reaction" and "flux".
+    """
+    if getattr(com, "reduction", None) is not None:
+        logger.warning(
+            "%s was reduced for the western diet, fluxes on diets with "
+            "other imports may be wrong." % sam
+        )
+    ex_ids = [r.id for r in com.exchanges]
+    diets = diets.loc[:, diets.columns.isin(ex_ids)]
+    rates, exchanges = [], []
+    with com, warm_start(com):
+        for name, diet in diets.iterrows():
+            with com, phase("diet_scan", sam, com):
+                com.medium = diet[diet > 0]
+                try:
+                    sol = tradeoff_sweep(com, [fraction], fluxes=True)
+                except OptimizationError:
+                    logger.warning("%s does not grow on %s." % (sam, name))
+                    continue
+            sol = sol.solution.iloc[0]
+            gcs = sol.members["growth_rate"].copy()
+            gcs["community"] = sol.growth_rate
+            gcs = gcs.rename_axis("compartment").rename("growth_rate")
+            rates.append(gcs.reset_index().assign(diet=name))
+            fluxes = sol.fluxes.drop(columns="sample", errors="ignore")
+            fluxes = fluxes.loc[:, fluxes.columns.str.startswith("EX_")]
+            fluxes = fluxes.rename_axis("compartment")
+            fluxes = fluxes.rename_axis("reaction", axis=1).stack()
+            fluxes = fluxes[fluxes != 0].rename("flux").reset_index()
+            exchanges.append(fluxes.assign(diet=name))
+
+    def table(dfs, columns):
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=["sample", "diet"] + columns)
+        df = pd.concat(dfs, ignore_index=True)
+        df["sample"] = sam
+        return df[["sample", "diet"] + columns]
+
+    return {
+        "growth_rates": table(rates, ["compartment", "growth_rate"]),
+        "exchanges": table(exchanges, ["compartment", "reaction", "flux"]),
+    }
+
+
+def knockouts(com, sam, taxa=None):
+    """Get the growth rate changes for single taxon knockouts."""
+    with phase("knockouts", sam, com):
+        ko = knockout_taxa(com, taxa, fraction=0.5)
+    ko["sample"] = sam
+    return ko
+
+
+def knockout_tasks(samples, chunk_size):
+    """Split the knockouts for large communities into several tasks.
+
+    Returns a list of (sample, taxa) tuples where taxa is None if all taxa
+    of the sample fit into a single task.
+    """
+    tasks = []
+    for sam in samples:
+        taxa = load_taxa(sam)
+        if taxa is None or len(taxa) <= chunk_size:
+            tasks.append((sam, None))
+            continue
+        n = int(np.ceil(len(taxa) / chunk_size))
+        tasks.extend((sam, list(chunk)) for chunk in np.array_split(taxa, n))
+    return tasks
+
+
+def task_id(task):
+    """Get a unique name for a knockout task."""
+    sam, taxa = task
+    return sam if taxa is None else sam + "__" + taxa[0]
+
+
+def collect_knockouts(parts, store, tasks):
+    """Join the knockout results of split samples.
+
+    Samples are only written if all of their parts are present. Otherwise
+    the sample is logged as failed and the existing parts are kept.
+    """
+    split = {}
+    for task in tasks:
+        if task[1] is not None:
+            split.setdefault(task[0], []).append(task_id(task))
+    for sam, ids in split.items():
+        missing = [i for i in ids if not isfile(parts.path(i))]
+        if len(missing) > 0:
+            logger.error(
+                "knockouts for %s failed, %d of %d parts are missing."
+                % (sam, len(missing), len(ids))
+            )
+            continue
+        store.write(sam, parts.read(ids))
+        for i in ids:
+            remove(parts.path(i))
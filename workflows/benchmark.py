@@ -0,0 +1,321 @@
+"""Benchmark the workflows on synthetic communities.
+
+Builds small and large communities from copies of the E. coli core model
+with random knockouts, runs them through the same code paths as
+`build_models`, `tradeoff`, `media_and_gcs`, `knockouts` and
+`elasticities`, and reports the throughput and peak memory of every stage.
+It also checks that all elasticities are labeled with the taxon of their
+response reaction. Everything runs offline.
+
+Afterwards the tradeoff, growth rate and minimal medium results for the
+reference samples are recalculated from their models in `data/models` and
+compared to the committed tables and to the growth rates and minimal media
+of unchained solves. The script fails if they deviate by more than the
+tolerance.
+"""
+
+from os.path import join
+from shutil import rmtree
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import micom
+from cobra.exceptions import OptimizationError
+from micom import Community
+from micom.media import minimal_medium
+from model_cache import cached_model
+from model_store import has_model, load_community, save_taxa
+from analyses import tradeoff_grid, tradeoff_rates, media_and_gcs, knockouts
+from effectors import elasticities
+from metrics import phase
+from pool import pool_options, run
+
+try:
+    from cobra.test import create_test_model
+except ImportError:
+    from cobra.io import load_model as create_test_model
+
+logger = micom.logger.logger
+logger.add("micom.log")
+try:
+    max_procs = snakemake.threads
+    config = snakemake.config
+    references = list(snakemake.params.references)
+except NameError:
+    max_procs = 20
+    config = {}
+    references = ["ERR260275", "ERR260214", "ERR260174"]
+tolerance = config.get("benchmark_tolerance", 1e-3)
+seed = config.get("benchmark_seed", 42)
+
+sizes = {
+    "small": {"samples": 8, "taxa": 5},
+    "large": {"samples": 4, "taxa": 40},
+}
+stages = {
+    "build_models": ["model_cache", "build", "save"],
+    "tradeoff": ["load", "tradeoff", "tradeoff_table"],
+    "media_and_gcs": [
+        "growth_rates",
+        "minimal_medium",
+        "medium_fluxes",
+        "flux_table",
+    ],
+    "knockouts": ["knockouts"],
+    "elasticities": ["elasticities"],
+}
+tradeoffs = tradeoff_grid()
+workdir = tempfile.mkdtemp(prefix="micom_benchmark_")
+
+
+def synthetic_taxa(n, directory, rng):
+    """Save `n` variants of the E. coli core model with random knockouts.
+
+    Only reactions whose single knockout is not lethal are removed.
+    """
+    base = create_test_model("textbook")
+    max_growth = base.slim_optimize()
+    candidates = []
+    for r in base.reactions:
+        if r.boundary or r.objective_coefficient != 0:
+            continue
+        with base:
+            r.knock_out()
+            if base.slim_optimize(error_value=0.0) > 0.1 * max_growth:
+                candidates.append(r.id)
+    files = []
+    for i in range(n):
+        model = base.copy()
+        model.id = "taxon%d" % i
+        for rid in rng.choice(candidates, 3, replace=False):
+            model.reactions.get_by_id(rid).knock_out()
+        files.append(join(directory, model.id + ".pickle"))
+        pd.to_pickle(model, files[-1])
+    return files
+
+
+def synthetic_taxonomy(size, rng):
+    """Get the taxonomy for a set of synthetic samples."""
+    n_samples, n_taxa = sizes[size]["samples"], sizes[size]["taxa"]
+    files = synthetic_taxa(2 * n_taxa, workdir, rng)
+    taxonomy = []
+    for s in range(n_samples):
+        taxa = rng.choice(len(files), n_taxa, replace=False)
+        taxonomy.append(
+            pd.DataFrame(
+                {
+                    "id": ["taxon%d" % t for t in taxa],
+                    "file": [files[t] for t in taxa],
+                    "abundance": rng.dirichlet(np.ones(n_taxa)),
+                    "samples": "%s%d" % (size, s),
+                }
+            )
+        )
+    return pd.concat(taxonomy)
+
+
+def benchmark_sample(sam):
+    """Run all workflow stages for a synthetic sample."""
+    tax = taxonomy[taxonomy.samples == sam].copy()
+    with phase("model_cache", sam):
+        tax["file"] = tax.file.apply(
+            lambda f: cached_model([f], join(workdir, "cache"))
+        )
+    with phase("build", sam):
+        com = Community(tax, id=sam, progress=False)
+    with phase("save", sam):
+        filename = join(workdir, sam + ".pickle")
+        com.to_pickle(filename)
+        save_taxa(com, filename)
+    com = load_community(sam, workdir)
+    tradeoff_rates(com, sam, tradeoffs)
+    media_and_gcs(com, sam)
+    knockouts(com, sam)
+    reactions = [r for r in com.reactions if r.global_id.startswith("EX_")]
+    with phase("elasticities", sam, com):
+        elast = elasticities(com, fraction=0.5, reactions=reactions)
+    return mislabeled(com, elast)
+
+
+def mislabeled(com, elast):
+    """Count elasticities that are not labeled with their taxon.
+
+    Responses of medium exchanges must be labeled "medium" and all others
+    with a taxon of the community.
+    """
+    medium = elast.reaction.isin([r.id for r in com.exchanges])
+    wrong = (medium & (elast.taxon != "medium")) | (
+        ~medium & ~elast.taxon.isin(com.species)
+    )
+    return int(wrong.sum())
+
+
+def unchained_media(com, sam):
+    """Get growth rates and the minimal medium with independent solves.
+
+    This is the sequence `media_and_gcs` used before it chained the solves.
+    """
+    sol = com.cooperative_tradeoff(fraction=0.5)
+    rates = sol.members["growth_rate"].copy()
+    rates["community"] = sol.growth_rate
+    rates.name = sam
+    med = minimal_medium(com, 0.95 * sol.growth_rate, exports=True)
+    if med is None:
+        raise OptimizationError("could not get a minimal medium for %s." % sam)
+    med.name = sam
+    return {"gcs": rates, "medium": med}
+
+
+def reference_sample(sam):
+    """Recalculate the committed results for a sample."""
+    com = load_community(sam)
+    media = media_and_gcs(com, sam)
+    return {
+        "tradeoff": tradeoff_rates(com, sam, tradeoffs),
+        "gcs": media["gcs"],
+        "medium": media["medium"],
+        "unchained": unchained_media(load_community(sam), sam),
+    }
+
+
+def compare(table, new, old):
+    """Compare aligned results to the reference values."""
+    new, old = new.align(old, join="inner")
+    diff = (new - old).abs().fillna(0.0)
+    close = np.isclose(new, old, rtol=tolerance, atol=1e-6, equal_nan=True)
+    return {
+        "table": table,
+        "compared": close.size,
+        "max_abs_diff": diff.values.max() if diff.size > 0 else np.nan,
+        "passed": bool(close.all()),
+    }
+
+
+def check_references(samples):
+    """Compare the recalculated results for samples to the reference."""
+    results = run(
+        reference_sample,
+        samples,
+        max_procs,
+        name="benchmark_reference",
+        **pool_options(config)
+    )
+    results = [r for r in results if r is not None]
+    if len(results) < len(samples):
+        logger.error("could not recalculate all reference samples.")
+        return [{"table": "all", "compared": 0, "passed": False}]
+
+    def tradeoff_index(df):
+        if "compartments" not in df.columns:
+            df = df.reset_index()
+        df = df.rename(columns={"index": "compartments"})
+        df["tradeoff"] = df.tradeoff.round(2).fillna(-1)
+        return df.set_index(["sample", "compartments", "tradeoff"])
+
+    old = pd.read_csv("data/tradeoff.csv")
+    old = tradeoff_index(old[old["sample"].isin(samples)])
+    new = tradeoff_index(pd.concat(r["tradeoff"] for r in results))
+    checks = [compare("tradeoff", new.growth_rate, old.growth_rate)]
+
+    old = pd.read_csv("data/growth_rates.csv", index_col=0)
+    new = pd.DataFrame([r["gcs"] for r in results])
+    old = old.loc[new.index, new.columns.intersection(old.columns)]
+    checks.append(compare("growth_rates", new.fillna(0.0), old.fillna(0.0)))
+
+    # Minimal media can have alternative optima, only the total import
+    # flux that is minimized is unique
+    old = pd.read_csv("data/minimal_imports.csv", index_col=0)
+    new = pd.DataFrame([r["medium"] for r in results]).clip(lower=0)
+    old = old.loc[new.index].clip(lower=0)
+    checks.append(
+        compare("minimal_imports", new.sum(axis=1), old.sum(axis=1))
+    )
+
+    # The chained solves must give the same results as independent ones
+    gcs = pd.DataFrame([r["gcs"] for r in results])
+    old = pd.DataFrame([r["unchained"]["gcs"] for r in results])
+    checks.append(
+        compare("chained_growth_rates", gcs.fillna(0.0), old.fillna(0.0))
+    )
+    old = pd.DataFrame([r["unchained"]["medium"] for r in results])
+    checks.append(
+        compare(
+            "chained_imports", new.sum(axis=1), old.clip(lower=0).sum(axis=1)
+        )
+    )
+    return checks
+
+
+rng = np.random.RandomState(seed)
+report = []
+n_mislabeled = 0
+try:
+    for size in sizes:
+        taxonomy = synthetic_taxonomy(size, rng)
+        samples = taxonomy.samples.unique()
+        options = pool_options(config)
+        options["profile"] = True
+        start = time.time()
+        counts = run(
+            benchmark_sample,
+            samples,
+            max_procs,
+            name="benchmark_" + size,
+            **options
+        )
+        wall = time.time() - start
+        n_mislabeled += sum(c for c in counts if c is not None)
+        metrics = pd.read_csv("data/metrics/benchmark_%s.csv" % size)
+        metrics = metrics[metrics.attempt == 0]
+        for stage, phases in stages.items():
+            m = metrics[metrics.phase.isin(phases)].groupby("sample")
+            seconds = m.seconds.sum().mean()
+            report.append(
+                {
+                    "size": size,
+                    "taxa": sizes[size]["taxa"],
+                    "stage": stage,
+                    "samples": len(samples),
+                    "seconds_per_sample": seconds,
+                    "samples_per_hour": 3600.0 / seconds,
+                    "process_peak_mb": m.process_peak_mb.max().max(),
+                    "peak_increase_mb": m.peak_increase_mb.sum().max(),
+                }
+            )
+        increase = metrics.groupby("sample").peak_increase_mb.sum()
+        report.append(
+            {
+                "size": size,
+                "taxa": sizes[size]["taxa"],
+                "stage": "total",
+                "samples": len(samples),
+                "seconds_per_sample": wall / len(samples),
+                "samples_per_hour": 3600.0 * len(samples) / wall,
+                "process_peak_mb": metrics.process_peak_mb.max(),
+                "peak_increase_mb": increase.max(),
+            }
+        )
+finally:
+    rmtree(workdir, ignore_errors=True)
+report = pd.DataFrame(report)
+report.to_csv("data/benchmark.csv", index=False)
+print(report.to_string(index=False))
+if n_mislabeled > 0:
+    logger.error("%d elasticities have the wrong taxon." % n_mislabeled)
+    sys.exit(1)
+
+available = [s for s in references if has_model(s)]
+if len(available) == 0:
+    logger.warning("no reference models found, skipping the reference check.")
+    sys.exit(0)
+checks = pd.DataFrame(check_references(available))
+checks.to_csv("data/benchmark_reference.csv", index=False)
+print(checks.to_string(index=False))
+if not checks.passed.all():
+    logger.error(
+        "results deviate from the reference tables by more than %g."
+        % tolerance
+    )
+    sys.exit(1)
@@ -1,20 +1,40 @@
-"""Builds the community models."""
+"""Builds the community models.
 
+With the `template_models` option only one community is built for every
+distinct set of taxa. Samples are saved as the template and their
+abundances, which are applied when the sample is loaded. With the
+`reduce_models` option blocked reactions are removed and linear reaction
+chains merged for the diet (see `reduction.py`).
+"""
+
+import fcntl
+import hashlib
+import os
 from os import makedirs
-from os.path import isfile
+from os.path import isfile, join
+import tempfile
 import micom
 from micom import Community
 import pandas as pd
-from micom.workflows import workflow
+from metrics import phase
+from model_cache import cached_model
+from model_store import save_reduction, save_sample, save_taxa
+from pool import pool_options, run, run_name
+from reduction import reduce_community
 
 logger = micom.logger.logger
 logger.add("micom.log")
 try:
     max_procs = snakemake.threads
+    config = snakemake.config
 except NameError:
     max_procs = 20
+    config = {}
 
-makedirs("data/models", exist_ok=True)
+templates = config.get("template_models", False)
+reduce_models = config.get("reduce_models", False)
+template_dir = "data/models/templates"
+makedirs(template_dir if templates else "data/models", exist_ok=True)
 
 taxonomy = pd.read_csv("data/genera.csv").query("relative > 1e-3")
 taxonomy["file"] = taxonomy.file.apply(
@@ -29,12 +49,16 @@ diet.index = diet.reaction = diet.reaction.str.replace("_e", "_m")
 diet = diet.flux * diet.dilution
 
 
-def build_and_save(args):
-    s, tax = args
-    filename = "data/models/" + s + ".pickle"
-    if isfile(filename):
-        return
-    com = Community(tax, id=s, progress=False)
+def build(tax, s):
+    """Build a community with the diet applied.
+
+    Returns the community and the reaction mapping if it was reduced.
+    """
+    tax = tax.copy()
+    with phase("model_cache", s):
+        tax["file"] = tax.file.apply(cached_model)
+    with phase("build", s):
+        com = Community(tax, id=s, progress=False)
     ex_ids = [r.id for r in com.exchanges]
     logger.info(
         "%d/%d import reactions found in model.",
@@ -42,9 +66,78 @@ def build_and_save(args):
         len(diet),
     )
     com.medium = diet[diet.index.isin(ex_ids)]
-    com.to_pickle(filename)
+    reduction = None
+    if reduce_models:
+        with phase("reduce", s, com):
+            reduction = reduce_community(com)
+    return com, reduction
+
+
+def template_key(tax):
+    """Get the template key for the taxa of a sample and the diet."""
+    h = hashlib.sha256(diet.to_json().encode())
+    h.update(repr(reduce_models).encode())
+    for taxon, files in sorted(zip(tax.id, tax.file)):
+        h.update(repr((taxon, files)).encode())
+    return h.hexdigest()[:16]
+
+
+def build_template(tax, s):
+    """Get the template community for the taxa of a sample.
+
+    The template is only built if no other sample with the same taxa has
+    built it already.
+    """
+    filename = join(template_dir, template_key(tax) + ".pickle")
+    if isfile(filename):
+        return filename
+    with open(filename + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not isfile(filename):
+            logger.info("building template for %s." % s)
+            com, reduction = build(tax, s)
+            with phase("save", s):
+                fd, tmp = tempfile.mkstemp(dir=template_dir, suffix=".tmp")
+                os.close(fd)
+                com.to_pickle(tmp)
+                save_taxa(com, filename)
+                if reduction is not None:
+                    save_reduction(reduction, filename)
+                os.replace(tmp, filename)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return filename
 
 
-samples = taxonomy.samples.unique()
-args = [(s, taxonomy[taxonomy.samples == s]) for s in samples]
-workflow(build_and_save, args, max_procs)
+def build_and_save(s):
+    # only skip samples that already have the output of the current mode
+    descriptor = "data/models/" + s + ".json"
+    filename = "data/models/" + s + ".pickle"
+    if isfile(descriptor if templates else filename):
+        return
+    tax = taxonomy[taxonomy.samples == s]
+    if templates:
+        template = build_template(tax, s)
+        save_sample(s, template, tax.set_index("id").abundance)
+        return
+    com, reduction = build(tax, s)
+    with phase("save", s):
+        com.to_pickle(filename)
+        save_taxa(com, filename)
+        if reduction is not None:
+            save_reduction(reduction, filename)
+        # descriptors take precedence when loading
+        if isfile(descriptor):
+            os.remove(descriptor)
+
+
+try:
+    samples = [snakemake.wildcards.sample]
+except (NameError, AttributeError):
+    samples = taxonomy.samples.unique()
+run(
+    build_and_save,
+    samples,
+    max_procs,
+    name=run_name("build_models", samples),
+    **pool_options(config)
+)
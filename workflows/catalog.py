@@ -0,0 +1,66 @@
+"""An indexed catalog of the AGORA models.
+
+Maps every genus or species to the files of all AGORA models for that
+taxon together with the taxonomy and metadata of the first model. The
+catalogs are built from `micom.data.agora` once and saved as Parquet files
+indexed by the taxon, so later runs only need to read them.
+"""
+
+from os.path import dirname, getmtime, isfile, join
+import pandas as pd
+import micom
+import micom.data
+
+logger = micom.logger.logger
+ranks = {"genus": ["genus"], "species": ["genus", "species"]}
+
+
+def build_catalog(rank):
+    """Collapse the AGORA models to a taxonomic rank.
+
+    Arguments
+    ---------
+    rank : str
+        Either "genus" or "species".
+
+    Returns
+    -------
+    pandas.DataFrame
+        The AGORA metadata indexed by the rank with a "file" column
+        containing the model files for each taxon separated by "|".
+
+    """
+    keys = ranks[rank]
+    agora = micom.data.agora.rename(columns={"mclass": "class"})
+    agora = agora.dropna(subset=keys)
+    agora["file"] = agora.id + ".xml"
+    files = agora.groupby(keys).file.agg("|".join)
+    catalog = agora.drop_duplicates(keys).set_index(keys).sort_index()
+    catalog["file"] = files
+    return catalog
+
+
+def load_catalog(rank, directory="data"):
+    """Load the catalog for a rank.
+
+    The catalog is rebuilt if it is missing or older than the AGORA table
+    shipped with micom.
+    """
+    filename = join(directory, "agora_%s.parquet" % rank)
+    agora_file = join(dirname(micom.data.__file__), "agora.csv")
+    if isfile(filename) and getmtime(filename) >= getmtime(agora_file):
+        return pd.read_parquet(filename)
+    logger.info("building the AGORA %s catalog." % rank)
+    catalog = build_catalog(rank)
+    catalog.to_parquet(filename)
+    return catalog
+
+
+def lineages(ranks):
+    """Get the set of taxa with an AGORA model for each rank.
+
+    Species are given as "genus species" like in the abundance tables.
+    """
+    agora = micom.data.agora.rename(columns={"mclass": "class"})
+    agora = agora.assign(species=agora.genus + " " + agora.species)
+    return {rank: set(agora[rank].dropna()) for rank in ranks}
@@ -0,0 +1,25 @@
+"""Combine the phase metrics of the per-sample jobs into one table per rule.
+
+Writes `data/metrics/<rule>.csv` for the rules that run once per sample.
+"""
+
+from os.path import basename, splitext
+import pandas as pd
+import micom
+import metrics
+
+logger = micom.logger.logger
+logger.add("micom.log")
+try:
+    outputs = list(snakemake.output)
+except NameError:
+    outputs = [
+        "data/metrics/%s.csv" % rule
+        for rule in ["build_models", "sample_analyses", "elasticities"]
+    ]
+
+samples = pd.read_csv("data/recent.csv").run_accession.tolist()
+for out in outputs:
+    name = splitext(basename(out))[0]
+    metrics.combine(name, samples)
+    logger.info("combined the metrics for %s into %s." % (name, out))
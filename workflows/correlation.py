@@ -0,0 +1,164 @@
+"""Correlations for many groups at once.
+
+All groups are handled together with sparse group sums instead of running
+a correlation for every group. Bootstrap intervals use the Poisson
+bootstrap, where every observation gets a random Poisson(1) weight in
+every replicate. That keeps the groups aligned across replicates, so
+batches of replicates are evaluated as weighted correlations with a few
+matrix products and run in parallel via `pool.run`.
+"""
+
+from functools import partial
+import warnings
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.stats import t
+from pool import run
+
+
+def _weighted_ranks(codes, values, weights):
+    """Rank values within groups as if every value was repeated by its weight.
+
+    Ties get the average rank. `weights` has one column per replicate.
+    """
+    order = np.lexsort((values, codes))
+    c, v = codes[order], values[order]
+    new_block = np.r_[True, (c[1:] != c[:-1]) | (v[1:] != v[:-1])]
+    starts = np.flatnonzero(new_block)
+    block_weights = np.add.reduceat(weights[order], starts, axis=0)
+    before = np.cumsum(block_weights, axis=0) - block_weights
+    new_group = np.r_[True, c[starts][1:] != c[starts][:-1]]
+    offset = before[np.flatnonzero(new_group)][np.cumsum(new_group) - 1]
+    block_ranks = before - offset + (block_weights + 1) / 2
+    ranks = np.empty(weights.shape)
+    ranks[order] = block_ranks[np.cumsum(new_block) - 1]
+    return ranks
+
+
+def _weighted_pearson(groups, x, y, weights):
+    """Get weighted Pearson correlations for all groups and replicates."""
+    sw = groups @ weights
+    sx = groups @ (weights * x)
+    sy = groups @ (weights * y)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = groups @ (weights * x * y) - sx * sy / sw
+        vx = groups @ (weights * x ** 2) - sx ** 2 / sw
+        vy = groups @ (weights * y ** 2) - sy ** 2 / sw
+        r = np.where((vx > 0) & (vy > 0), cov / np.sqrt(vx * vy), np.nan)
+    return np.clip(r, -1.0, 1.0)
+
+
+def _correlate(groups, codes, xs, ys, method, weights):
+    """Get weighted correlations for all groups and replicates."""
+    if method == "spearman":
+        return _weighted_pearson(
+            groups,
+            _weighted_ranks(codes, xs, weights),
+            _weighted_ranks(codes, ys, weights),
+            weights,
+        )
+    return _weighted_pearson(groups, xs[:, None], ys[:, None], weights)
+
+
+def _replicates(groups, codes, xs, ys, method, batch):
+    """Get the correlations for a batch of Poisson bootstrap replicates."""
+    size, seed = batch
+    rng = np.random.RandomState(seed)
+    weights = rng.poisson(1.0, size=(len(codes), size))
+    return _correlate(groups, codes, xs, ys, method, weights.astype(float))
+
+
+def grouped_correlation(
+    df,
+    by,
+    x,
+    y,
+    method="pearson",
+    bootstrap=0,
+    level=0.95,
+    processes=1,
+    batch_size=100,
+    seed=42,
+):
+    """Correlate two columns within every group.
+
+    Arguments
+    ---------
+    df : pandas.DataFrame
+        The data.
+    by : str or list of str
+        The columns defining the groups.
+    x, y : str
+        The columns to correlate.
+    method : str
+        Either "pearson" or "spearman".
+    bootstrap : int
+        The number of bootstrap replicates for the confidence intervals.
+        No intervals are calculated if 0.
+    level : float
+        The confidence level of the intervals.
+    processes : positive int
+        How many batches of replicates to run in parallel.
+    batch_size : positive int
+        The number of replicates in a single batch.
+    seed : int
+        The seed for the bootstrap.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The columns from `by` followed by the correlation "rho", its
+        p-value "p" and the number of observations "n" for every group.
+        Groups with less than 3 observations have a correlation of NaN.
+        With bootstrap replicates the confidence interval is added as
+        "rho_low" and "rho_high".
+    """
+    if method not in ["pearson", "spearman"]:
+        raise ValueError("method must be either 'pearson' or 'spearman'.")
+    by = [by] if isinstance(by, str) else list(by)
+    df = df.dropna(subset=by + [x, y])
+    grouped = df.groupby(by, sort=True)
+    codes = grouped.ngroup().values
+    n_obs = np.bincount(codes, minlength=grouped.ngroups)
+    groups = csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(grouped.ngroups, len(codes)),
+    )
+    xs, ys = df[x].values.astype(float), df[y].values.astype(float)
+    if method == "pearson":
+        # centering within groups avoids cancellation in the sums
+        xs = xs - (groups @ xs / n_obs)[codes]
+        ys = ys - (groups @ ys / n_obs)[codes]
+
+    weights = np.ones((len(codes), 1))
+    rho = _correlate(groups, codes, xs, ys, method, weights)[:, 0]
+    rho[n_obs < 3] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stat = rho * np.sqrt((n_obs - 2) / (1.0 - rho ** 2))
+        p = 2 * t.sf(np.abs(stat), n_obs - 2)
+    res = grouped.size().reset_index()[by]
+    res["rho"] = rho
+    res["p"] = np.where(np.isnan(rho), np.nan, p)
+    res["n"] = n_obs.astype(float)
+    if bootstrap == 0:
+        return res
+
+    sizes = [batch_size] * (bootstrap // batch_size)
+    if bootstrap % batch_size > 0:
+        sizes.append(bootstrap % batch_size)
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=len(sizes))
+    boot = run(
+        partial(_replicates, groups, codes, xs, ys, method),
+        list(zip(sizes, seeds)),
+        min(processes, len(sizes)),
+        unit="batch(es)",
+    )
+    boot = np.hstack([b for b in boot if b is not None])
+    alpha = (1.0 - level) / 2
+    with warnings.catch_warnings():
+        # groups with too few observations only have NaN replicates
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanquantile(boot, [alpha, 1.0 - alpha], axis=1)
+    res["rho_low"] = np.where(np.isnan(rho), np.nan, low)
+    res["rho_high"] = np.where(np.isnan(rho), np.nan, high)
+    return res
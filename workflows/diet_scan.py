@@ -0,0 +1,90 @@
+"""Get growth rates and exchange fluxes for many diets across the cohort.
+
+Diets are read from `data/diets.csv`, a long table with the columns "diet",
+"reaction" and "flux" and optionally "dilution" that uses the same format
+as `data/western_diet.csv`. Every community is loaded once per task and all
+of its diets are solved in turn, starting from the previous solution. Long
+diet tables are split into tasks of at most `diet_chunk` diets so they can
+run on separate cores.
+"""
+
+import numpy as np
+import pandas as pd
+import micom
+from model_store import has_model, load_community
+from analyses import diet_scan
+from results import ResultStore
+from pool import pool_options, run, run_name
+
+
+logger = micom.logger.logger
+logger.add("micom.log")
+try:
+    max_procs = snakemake.threads
+    config = snakemake.config
+    chunk_size = snakemake.config.get("diet_chunk", 100)
+    outputs = list(snakemake.output)
+except NameError:
+    max_procs = 20
+    config = {}
+    chunk_size = 100
+    outputs = ["data/diet_growth_rates.csv", "data/diet_exchanges.csv.gz"]
+
+
+def read_diets(filename):
+    """Read a long table of diets into one row per diet.
+
+    Diets keep the order of the file and fluxes are already multiplied by
+    the dilution.
+    """
+    df = pd.read_csv(filename, dtype={"diet": str})
+    if "dilution" in df.columns:
+        df["flux"] = df.flux * df.dilution
+    df["reaction"] = df.reaction.str.replace(r"_e$", "_m", regex=True)
+    diets = df.pivot_table(
+        index="diet", columns="reaction", values="flux", aggfunc="sum"
+    )
+    return diets.reindex(df.diet.unique())
+
+
+diets = read_diets("data/diets.csv")
+samples = pd.read_csv("data/recent.csv").run_accession.tolist()
+samples = [s for s in samples if has_model(s)]
+n_chunks = max(1, int(np.ceil(len(diets) / chunk_size)))
+chunks = np.array_split(np.arange(len(diets)), n_chunks)
+tasks = [(s, i) for s in samples for i in range(n_chunks)]
+stores = {
+    "growth_rates": ResultStore("data/diet_scan/growth_rates"),
+    "exchanges": ResultStore("data/diet_scan/exchanges"),
+}
+logger.info(
+    "scanning %d diets for %d samples in %d tasks."
+    % (len(diets), len(samples), len(tasks))
+)
+
+
+def task_id(task):
+    """Get a unique name for a diet scan task."""
+    return "%s__%d" % task
+
+
+def scan(task):
+    """Solve a chunk of diets for a sample."""
+    sam, chunk = task
+    com = load_community(sam)
+    res = diet_scan(com, sam, diets.iloc[chunks[chunk]])
+    for name, store in stores.items():
+        store.write(task_id(task), res[name])
+    return True
+
+
+done = run(
+    scan,
+    tasks,
+    max_procs,
+    name=run_name("diet_scan", samples),
+    **pool_options(config)
+)
+ids = [task_id(t) for t, d in zip(tasks, done) if d is not None]
+stores["growth_rates"].combine(outputs[0], ids, index=False)
+stores["exchanges"].combine(outputs[1], ids, index=False)
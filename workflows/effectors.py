@@ -0,0 +1,137 @@
+"""Batched calculation of elasticity coefficients.
+
+Gives the same results as `micom.elasticity.elasticities` but only reads
+the primal values of the response reactions after each perturbation,
+computes all coefficients for a batch of effectors in a single vectorized
+step and warm-starts every perturbation from the base solution. The
+effectors can be split into several parts so a single sample can be
+spread across workers.
+"""
+
+from functools import partial
+import numpy as np
+import pandas as pd
+import micom
+from cobra.util import get_context
+from micom.problems import regularize_l2_norm
+from micom.solution import optimize_with_fraction
+from micom.util import reset_min_community_growth
+from solving import get_basis, set_basis, warm_start
+
+logger = micom.logger.logger
+STEP = 0.1
+
+
+def _primals(com, reactions):
+    """Get the current fluxes for a list of reactions."""
+    values = com.solver.primal_values
+    return np.array([values[r.id] - values[r.reverse_id] for r in reactions])
+
+
+def _derivatives(before, after):
+    """Get the elasticities for all effectors at once.
+
+    `before` contains one flux per reaction and `after` one row of fluxes
+    per effector.
+    """
+    before = np.broadcast_to(before, after.shape)
+    direction = np.full(after.shape, "zero", dtype="<U8")
+    direction[(before > 1e-6) | (after > 1e-6)] = "forward"
+    direction[(before < -1e-6) | (after < -1e-6)] = "reverse"
+    derivs = np.log(np.abs(after) + 1e-6) - np.log(np.abs(before) + 1e-6)
+    return derivs / STEP, direction
+
+
+def medium_effectors(com):
+    """Get the imported medium components in the current solution.
+
+    Returns a Series mapping exchange reactions to their import fluxes.
+    """
+    values = com.solver.primal_values
+    imports = {}
+    for ex in com.exchanges:
+        export = len(ex.reactants) == 1
+        flux = values[ex.id] - values[ex.reverse_id]
+        if export and (flux < -1e-6):
+            imports[ex] = flux
+        elif not export and (flux > 1e-6):
+            imports[ex] = -flux
+    return pd.Series(imports)
+
+
+def elasticities(com, fraction=0.5, reactions=None, part=0, n_parts=1):
+    """Calculate elasticities for diet and abundance effectors.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community for which to calculate elasticities.
+    fraction : double
+        The tradeoff to use for the cooperative tradeoff method.
+    reactions : list of cobra.Reaction, optional
+        The response reactions. Defaults to all reactions.
+    part : int
+        Which part of the effectors to use.
+    n_parts : int
+        In how many parts to split the effectors. Every `n_parts`-th effector
+        starting from `part` is used.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A data frame with the columns "reaction", "taxon", "effector",
+        "direction", "elasticity" and "type" like
+        `micom.elasticity.elasticities`.
+    """
+    if reactions is None:
+        reactions = com.reactions
+    with com, warm_start(com):
+        context = get_context(com)
+        context(partial(reset_min_community_growth, com))
+        regularize_l2_norm(com, 0.0)
+        optimize_with_fraction(com, fraction)
+        before = _primals(com, reactions)
+        basis = get_basis(com)
+
+        imports = medium_effectors(com)
+        effectors = [(r.id, "exchanges", r) for r in imports.index] + [
+            (sp, "abundance", sp) for sp in com.species
+        ]
+        effectors = effectors[part::n_parts]
+        logger.info(
+            "calculating elasticities for %d effectors in %s."
+            % (len(effectors), com.id)
+        )
+        abundance = com.abundances.copy()
+        after = np.zeros((len(effectors), len(reactions)))
+        for i, (_, kind, eff) in enumerate(effectors):
+            set_basis(com, basis)
+            if kind == "exchanges":
+                with com:
+                    if imports[eff] < -1e-6:
+                        eff.lower_bound *= np.exp(STEP)
+                    else:
+                        eff.upper_bound *= np.exp(STEP)
+                    optimize_with_fraction(com, fraction)
+                    after[i, :] = _primals(com, reactions)
+            else:
+                old = abundance[eff]
+                abundance[eff] *= np.exp(STEP)
+                com.set_abundance(abundance, normalize=False)
+                optimize_with_fraction(com, fraction)
+                after[i, :] = _primals(com, reactions)
+                abundance[eff] = old
+                com.set_abundance(abundance, normalize=False)
+
+    derivs, dirs = _derivatives(before, after)
+    n, m = len(reactions), len(effectors)
+    return pd.DataFrame(
+        {
+            "reaction": np.tile([r.global_id for r in reactions], m),
+            "taxon": np.tile([r.community_id for r in reactions], m),
+            "effector": np.repeat([e[0] for e in effectors], n),
+            "direction": dirs.ravel(),
+            "elasticity": derivs.ravel(),
+            "type": np.repeat([e[1] for e in effectors], n),
+        }
+    )
@@ -1,30 +1,65 @@
-"""Calculate the elasticities for a set of built models."""
+"""Calculate the elasticities for a set of built models.
+
+The effectors of each sample are split into several parts that run on
+separate workers.
+"""
 
 from os.path import isfile
+import pandas as pd
 import micom
-from micom import load_pickle
-from micom.elasticity import elasticities
-from micom.workflows import workflow
+from model_store import load_community
+from effectors import elasticities
+from metrics import phase
+from results import ResultStore
+from pool import pool_options, run, run_name
 
 
 logger = micom.logger.logger
 logger.add("micom.log")
 try:
     max_procs = snakemake.threads
+    config = snakemake.config
+    n_parts = snakemake.config.get("elasticity_parts", 4)
+    samples = [snakemake.wildcards.sample]
 except NameError:
     max_procs = 20
+    config = {}
+    n_parts = 4
+    samples = pd.read_csv("data/recent.csv").run_accession
+
+parts = ResultStore("data/elasticities")
+
+
+def part_id(sam, part):
+    return "%s__%d" % (sam, part)
+
+
+def elasticity_worker(args):
+    """Get the exchange elasticities for a part of a sample's effectors."""
+    sam, part = args
+    com = load_community(sam)
+    reactions = [r for r in com.reactions if r.global_id.startswith("EX_")]
+    with phase("elasticities", sam, com):
+        elast = elasticities(
+            com, fraction=0.5, reactions=reactions, part=part, n_parts=n_parts
+        )
+    parts.write(part_id(sam, part), elast)
 
 
-def elasticity_worker(sam):
-    """Get the exchange elasticities for a sample."""
-    model_file = "data/models/" + sam + ".pickle"
-    out_file = "data/elasticities_" + sam + ".csv"
-    if isfile(out_file):
-        return
-    com = load_pickle(model_file)
-    elast = elasticities(com, fraction=0.5)
-    elast.to_csv(out_file, index=False)
+def out_file(sam):
+    return "data/elasticities_" + sam + ".csv"
 
 
-samples = ["ERR260275", "ERR260214", "ERR260174"]
-workflow(elasticity_worker, samples, max_procs)
+samples = [s for s in samples if not isfile(out_file(s))]
+args = [(s, p) for s in samples for p in range(n_parts)]
+run(
+    elasticity_worker,
+    args,
+    max_procs,
+    name=run_name("elasticities", samples),
+    **pool_options(config)
+)
+for s in samples:
+    ids = [part_id(s, p) for p in range(n_parts)]
+    if all(isfile(parts.path(i)) for i in ids):
+        parts.read(ids).to_csv(out_file(s), index=False)
@@ -6,32 +6,30 @@ import nxviz
 import seaborn as sns
 import numpy as np
 import matplotlib.pyplot as plt
+from reactions import ReactionIndex
+import figure_data
 
 samples = {
     "ERR260275": "healthy",
     "ERR260214": "T2D metformin+",
     "ERR260174": "T2D metformin-",
 }
-metabolites = pd.read_csv("data/metabolites.csv")[
+metabolites = figure_data.metabolites()[
     ["abbreviation", "fullName", "keggId"]
 ]
-SCFAs = {"butyrate": "EX_but(e)", "acetate": "EX_ac(e)", "propionate": "EX_ppa(e)"}
+SCFAs = {
+    "butyrate": "^EX_but\\(e\\)",
+    "acetate": "^EX_ac\\(e\\)",
+    "propionate": "^EX_ppa\\(e\\)",
+}
 
 
 def direction(els, rid):
     return els[els.reaction == rid].direction.unique()[0]
 
 
-elast = []
-for sa in samples:
-    e = pd.read_csv("data/elasticities_" + sa + ".csv")
-    e["id"] = sa
-    elast.append(e)
-elast = pd.concat(elast)
-elast = elast[elast.direction == "forward"]
-elast["scfa"] = float("nan")
-for name, pattern in SCFAs.items():
-    elast.loc[elast.reaction.str.startswith(pattern), "scfa"] = name
+elast = figure_data.elasticities(list(samples))
+elast["scfa"] = ReactionIndex(elast.reaction, SCFAs).labels(elast.reaction)
 
 production = (
     elast.groupby(["id", "effector", "scfa"]).elasticity.sum().reset_index()
@@ -0,0 +1,113 @@
+"""Embeddings and distance statistics for large sparse profiles.
+
+None of the functions here build a dense distance matrix. Embeddings are
+initialized from a truncated SVD of the sparse profiles and Jaccard
+distances are summarized one block of rows at a time. PERMANOVA on the
+Euclidean distances is in `permutation.py`.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+from sklearn.manifold import TSNE
+
+
+def sparse_table(df, rows, columns, values):
+    """Convert a long data frame to a sparse matrix.
+
+    Arguments
+    ---------
+    df : pandas.DataFrame
+        The data in long format.
+    rows, columns, values : str
+        The columns containing the row names, column names and values.
+
+    Returns
+    -------
+    tuple of (scipy.sparse.csr_matrix, pandas.Index, pandas.Index)
+        The matrix and its row and column names. Duplicate entries are
+        summed.
+    """
+    r = pd.Categorical(df[rows])
+    c = pd.Categorical(df[columns])
+    mat = csr_matrix(
+        (df[values].values, (r.codes, c.codes)),
+        shape=(len(r.categories), len(c.categories)),
+    )
+    return mat, pd.Index(r.categories), pd.Index(c.categories)
+
+
+def embed(mat, n_components=2, svd_components=50, seed=42):
+    """Embed sparse profiles with a PCA-initialized Barnes-Hut TSNE.
+
+    The profiles are first reduced with a truncated SVD, so the TSNE only
+    works on a dense matrix with `svd_components` columns.
+    """
+    k = min(svd_components, mat.shape[1] - 1, mat.shape[0] - 1)
+    reduced = TruncatedSVD(k, random_state=seed).fit_transform(mat)
+    init = reduced[:, :n_components]
+    init = init / init[:, 0].std() * 1e-4
+    return TSNE(
+        n_components=n_components,
+        init=init,
+        method="barnes_hut",
+        random_state=seed,
+    ).fit_transform(reduced)
+
+
+def jaccard_summary(binary, block_size=2048, bins=100000):
+    """Summarize all pairwise Jaccard distances between rows.
+
+    Distances are calculated for one tile of `block_size` x `block_size`
+    pairs at a time, so memory use does not grow with the number of rows.
+    Quantiles are approximated from a histogram with `bins` bins.
+
+    Returns
+    -------
+    pandas.Series
+        The same statistics as `pandas.Series.describe`.
+    """
+    binary = csr_matrix(binary, dtype=float)
+    binary.data[:] = 1.0
+    sizes = np.asarray(binary.sum(axis=1)).ravel()
+    n = binary.shape[0]
+    counts = np.zeros(bins, dtype=np.int64)
+    total = total_sq = 0.0
+    lowest, highest = np.inf, -np.inf
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        rows = binary[start:end]
+        for col in range(start, n, block_size):
+            col_end = min(col + block_size, n)
+            shared = (rows @ binary[col:col_end].T).toarray()
+            union = sizes[start:end, None] + sizes[None, col:col_end] - shared
+            with np.errstate(invalid="ignore", divide="ignore"):
+                dist = np.where(union > 0, 1.0 - shared / union, 0.0)
+            if col == start:
+                # only use pairs i < j
+                dist = dist[np.triu_indices(end - start, k=1)]
+            else:
+                dist = dist.ravel()
+            total += dist.sum()
+            total_sq += (dist ** 2).sum()
+            if dist.size > 0:
+                lowest = min(lowest, dist.min())
+                highest = max(highest, dist.max())
+            counts += np.histogram(dist, bins=bins, range=(0.0, 1.0))[0]
+    count = counts.sum()
+    mean = total / count
+    cumulative = np.cumsum(counts)
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    quantiles = [
+        edges[np.searchsorted(cumulative, q * count) + 1]
+        for q in [0.25, 0.5, 0.75]
+    ]
+    return pd.Series(
+        [count, mean, np.sqrt((total_sq - count * mean ** 2) / (count - 1))]
+        + [lowest]
+        + quantiles
+        + [highest],
+        index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+    )
+
@@ -8,7 +8,10 @@ from scipy.stats import ttest_ind
 import numpy as np
 from itertools import combinations
 from scipy.spatial.distance import pdist
-from skbio.stats.distance import DistanceMatrix, permanova
+from reactions import ReactionIndex
+from embedding import embed, jaccard_summary, sparse_table
+from permutation import permanova
+import figure_data
 
 sample_keep = ["run_accession", "subset", "status", "type"]
 SCFAs = {
@@ -37,13 +40,18 @@ def pairwise_tests(x, y, name="tests", ref="CTRL"):
     return tests
 
 
-def export_rates_plot(fluxes, groups, samples, log=False):
+def export_rates_plot(fluxes, index, samples, log=False, stored=None):
+    sums = index.group_sum(fluxes, ["sample"], "tot_flux")
+    # the given samples have a flux of zero if they have none in a group,
+    # all others are missing
+    stored = samples.index.isin([] if stored is None else stored)
     dfs = []
-    for name, filt in groups.items():
-        df = fluxes[fluxes.reaction.str.contains(filt)].copy()
+    for name in index.groups:
         res = samples.copy()
-        df = df.groupby(["sample", "compartment"]).tot_flux.sum().reset_index()
-        res["flux"] = df.groupby("sample").tot_flux.sum().abs()
+        df = sums[sums.group == name].set_index("sample")
+        flux = df.tot_flux.abs().reindex(res.index)
+        flux[stored] = flux[stored].fillna(0.0)
+        res["flux"] = flux
         res["metabolite"] = name
         dfs.append(res)
     fluxes = pd.concat(dfs)
@@ -70,20 +78,8 @@ def export_rates_plot(fluxes, groups, samples, log=False):
     return pl
 
 
-samples = pd.read_csv("data/recent.csv")[
-    ["run_accession", "status", "subset", "type"]
-]
-samples = samples.rename(columns={"run_accession": "sample"})
-samples.index = samples["sample"]
-
-media = pd.read_csv("data/minimal_imports.csv", index_col=0).fillna(0.0)
-media["sample"] = media.index
-media = media.melt(id_vars="sample", var_name="reaction", value_name="flux")
-media = media[media.flux > 0]
-metabolites = pd.read_csv("data/metabolites.csv")
-metabolites["id"] = metabolites.abbreviation + "_m"
-media["id"] = media.reaction.str.lstrip("EX_")
-media = pd.merge(media, metabolites, on="id")
+samples = figure_data.samples()
+media = figure_data.media()
 
 mat = media.dropna(subset=["flux"]).pivot("id", "sample", "flux").fillna(0)
 stype = (
@@ -122,42 +118,32 @@ g.ax_col_colors.set_yticklabels(
 g.savefig("figures/media.png", dpi=300)
 plt.close()
 
-fluxes = pd.read_csv("data/minimal_fluxes.csv.gz", compression="gzip")
-fluxes = fluxes.melt(
-    id_vars=["sample", "compartment"], var_name="reaction", value_name="flux"
-)
-fluxes = fluxes[
-    fluxes.reaction.str.startswith("EX_")
-    & (fluxes.compartment != "medium")
-    & fluxes.reaction.str.endswith("(e)")
-].fillna(0)
-fluxes["taxa"] = fluxes.compartment + "_" + fluxes["sample"]
-fluxes["name"] = fluxes.compartment.str.replace("_", " ")
-
-species = pd.read_csv("data/genera.csv")[["samples", "genus", "reads"]]
-species["name"] = species.genus
-totals = species.groupby("samples").reads.sum()
-species["relative"] = species.reads / totals[species.samples].values
-fluxes = pd.merge(
-    fluxes, species, left_on=["sample", "name"], right_on=["samples", "name"]
-)
-fluxes["tot_flux"] = fluxes.flux * fluxes.relative
+# Only the non-zero exchange fluxes of the taxa
+fluxes = figure_data.exchange_fluxes()
+
+# All taxa in the communities, fluxes that are not stored are zero
+taxa_index = pd.MultiIndex.from_frame(figure_data.taxa())
+index = ReactionIndex(fluxes.reaction, SCFAs)
 print("Production rates:")
-pl = export_rates_plot(fluxes[fluxes.tot_flux > 0], SCFAs, samples)
+pl = export_rates_plot(fluxes[fluxes.tot_flux > 0], index, samples)
 pl.save("figures/scfas_prod.svg", width=4, height=6)
 
 print("Consumption rates:")
-pl = export_rates_plot(fluxes[fluxes.tot_flux < 0], SCFAs, samples)
+pl = export_rates_plot(fluxes[fluxes.tot_flux < 0], index, samples)
 pl.save("figures/scfas_consumption.svg", width=4, height=6)
 
 print("Net rates:")
-pl = export_rates_plot(fluxes, SCFAs, samples)
+pl = export_rates_plot(
+    fluxes, index, samples, stored=fluxes["sample"].unique()
+)
 pl.save("figures/scfas_net.svg", width=4, height=6)
 
 scfa = []
-for name, filt in SCFAs.items():
-    fl = fluxes[fluxes.reaction.str.contains(filt)].copy()
-    fl = fl.groupby(["sample", "name", "relative"]).flux.sum().reset_index()
+sums = index.group_sum(fluxes, ["sample", "name", "relative"], "flux")
+for name in SCFAs:
+    fl = sums[sums.group == name]
+    fl = fl.set_index(["sample", "name", "relative"]).flux
+    fl = fl.reindex(taxa_index, fill_value=0.0).reset_index()
     fl["metabolite"] = name
     scfa.append(fl)
     mat = fl.pivot("sample", "name", "flux")
@@ -200,10 +186,28 @@ pl = (
 pl.save("figures/relative_abundance.svg", width=2, height=5)
 
 
-mat = fluxes[fluxes.flux < 0].pivot("taxa", "reaction", "flux").fillna(0.0)
-taxa = mat.index.str.split("_ERR").str[0]
-tsne = TSNE(n_components=2).fit_transform(mat)
-tsne = pd.DataFrame(tsne, columns=["x", "y"], index=mat.index)
+# Large numbers of taxa are analyzed with sparse matrices and without any
+# distance matrices
+imports = fluxes[fluxes.flux < 0]
+try:
+    max_procs = snakemake.threads
+    permutations = snakemake.config.get("permutations", 9999)
+    scalable = snakemake.config.get(
+        "scalable_embedding", imports.taxa.nunique() > 5000
+    )
+except NameError:
+    max_procs = 20
+    permutations = 9999
+    scalable = imports.taxa.nunique() > 5000
+if scalable:
+    mat, rows, _ = sparse_table(imports, "taxa", "reaction", "flux")
+    tsne = embed(mat)
+else:
+    mat = imports.pivot("taxa", "reaction", "flux").fillna(0.0)
+    rows = mat.index
+    tsne = TSNE(n_components=2).fit_transform(mat)
+taxa = rows.str.split("_ERR").str[0]
+tsne = pd.DataFrame(tsne, columns=["x", "y"], index=rows)
 tsne["taxa"] = taxa
 sns.set(font_scale=1.5, style="ticks")
 g = sns.FacetGrid(tsne, hue="taxa", height=10, aspect=16 / 10)
@@ -221,18 +225,23 @@ plt.savefig("figures/individual_media.png", dpi=200)
 plt.close()
 
 # Some statistics about metabolite usage
-# indicator matrix 0 = metabolite not consumed, 1 = metabolite consumed
-binary = mat.where(mat < -1e-6, 0).where(mat > -1e-6, 1)
-
-# Jaccard distances = 1 - percent overlap
-J = pdist(binary, "jaccard")
-print("Jaccard distances:", pd.Series(J).describe(), sep="\n")
-
-# euclidean distances
-E = pdist(mat, "euclidean")
-
-# Test whether genus explains a good amount of that variation
-p = permanova(DistanceMatrix(E), taxa)
+if scalable:
+    # indicator matrix 0 = metabolite not consumed, 1 = metabolite consumed
+    binary = mat.multiply(mat < -1e-6)
+
+    # Jaccard distances = 1 - percent overlap, summarized in blocks
+    print("Jaccard distances:", jaccard_summary(binary), sep="\n")
+else:
+    # indicator matrix 0 = metabolite not consumed, 1 = metabolite consumed
+    binary = mat.where(mat < -1e-6, 0).where(mat > -1e-6, 1)
+
+    # Jaccard distances = 1 - percent overlap
+    J = pdist(binary, "jaccard")
+    print("Jaccard distances:", pd.Series(J).describe(), sep="\n")
+
+# Test whether genus explains a good amount of the variation in the
+# euclidean distances, those are not needed explicitly
+p = permanova(mat, taxa, permutations, max_procs)
 r2 = 1 - 1 / (1 + p[4] * p[3] / (p[2] - p[3] - 1))
 p["R2"] = r2
 print("PERMANOVA on euclidean distances:", p, sep="\n")
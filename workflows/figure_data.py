@@ -0,0 +1,221 @@
+"""A cached data layer for the figure scripts.
+
+Every table the figure scripts use is defined here once, including the
+renames, reshaping and transformations. Tables are saved as Parquet files
+in `data/figure_cache` keyed by the size and modification time of their
+input files, the arguments and the source code of this module, so tables
+built from other tables are rebuilt when those change as well. Later calls
+only read the cached table, and any change to the inputs or the code
+rebuilds it.
+"""
+
+from functools import wraps
+import hashlib
+import inspect
+import os
+from os import listdir, makedirs
+from os.path import isdir, isfile, join
+import tempfile
+import numpy as np
+import pandas as pd
+from results import FluxStore
+
+cache_dir = "data/figure_cache"
+
+
+def _signature(path):
+    """Get the size and modification time of a file or directory."""
+    if isdir(path):
+        return [[f] + _signature(join(path, f)) for f in sorted(listdir(path))]
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def table(inputs):
+    """Register a cached table.
+
+    Arguments
+    ---------
+    inputs : list of str or function
+        The files or directories the table is built from. Can also be a
+        function that gets the same arguments as the table and returns the
+        list.
+    """
+
+    def decorator(func):
+        # the whole module, since tables use other tables and helpers
+        source = inspect.getsource(inspect.getmodule(func))
+
+        @wraps(func)
+        def cached(*args, **kwargs):
+            files = inputs(*args, **kwargs) if callable(inputs) else inputs
+            h = hashlib.sha256(source.encode())
+            h.update(repr((args, sorted(kwargs.items()))).encode())
+            for f in files:
+                h.update(repr((f, _signature(f))).encode())
+            name = "%s.%s.parquet" % (func.__name__, h.hexdigest()[:16])
+            filename = join(cache_dir, name)
+            if isfile(filename):
+                try:
+                    return pd.read_parquet(filename)
+                except FileNotFoundError:
+                    pass  # removed by a concurrent rebuild
+            df = func(*args, **kwargs)
+            makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            os.close(fd)
+            df.to_parquet(tmp)
+            os.replace(tmp, filename)
+            # other processes may be cleaning up at the same time
+            for old in listdir(cache_dir):
+                if old.startswith(func.__name__ + ".") and old != name:
+                    try:
+                        os.remove(join(cache_dir, old))
+                    except FileNotFoundError:
+                        pass
+            return df
+
+        return cached
+
+    return decorator
+
+
+@table(["data/recent.csv"])
+def samples():
+    """Get the sample metadata indexed by run accession."""
+    df = pd.read_csv(
+        "data/recent.csv",
+        usecols=["run_accession", "status", "subset", "type"],
+        dtype=str,
+    )
+    df = df.rename(columns={"run_accession": "sample"})
+    df.index = df["sample"].values
+    return df
+
+
+@table(["data/tradeoff.csv"])
+def rates():
+    """Get the growth rates for all tradeoff values.
+
+    The tradeoff is also given as a label ("none" for the growth rates
+    without tradeoff) and growth rates as log10 values with -16 for
+    non-growing taxa.
+    """
+    df = (
+        pd.read_csv(
+            "data/tradeoff.csv",
+            dtype={"compartments": str, "sample": str},
+        )
+        .dropna(subset=["abundance"])
+        .rename(columns={"sample": "id", "compartments": "genus"})
+    )
+    df["tradeoff_label"] = df.tradeoff.round(2).astype("str")
+    df.loc[df.tradeoff_label == "nan", "tradeoff_label"] = "none"
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["log_rates"] = np.log10(df.growth_rate)
+    df.loc[df.growth_rate <= 0, "log_rates"] = -16
+    return df
+
+
+@table(["data/replication_rates.csv"])
+def replication():
+    """Get the mean replication rate for every genus and sample."""
+    return (
+        pd.read_csv(
+            "data/replication_rates.csv",
+            usecols=["id", "genus", "intercept", "rate"],
+            dtype={"id": str, "genus": str},
+        )
+        .query("intercept > 1")
+        .groupby(["id", "genus"])
+        .rate.mean()
+        .reset_index()
+    )
+
+
+@table(["data/metabolites.csv"])
+def metabolites():
+    """Get the metabolite annotations."""
+    return pd.read_csv("data/metabolites.csv", dtype=str)
+
+
+@table(["data/minimal_imports.csv", "data/metabolites.csv"])
+def media():
+    """Get the non-zero minimal media imports with their annotations."""
+    df = pd.read_csv("data/minimal_imports.csv", index_col=0).fillna(0.0)
+    df["sample"] = df.index
+    df = df.melt(id_vars="sample", var_name="reaction", value_name="flux")
+    df = df[df.flux > 0]
+    annotations = metabolites()
+    annotations["id"] = annotations.abbreviation + "_m"
+    df["id"] = df.reaction.str.lstrip("EX_")
+    return pd.merge(df, annotations, on="id")
+
+
+@table(["data/genera.csv"])
+def genera():
+    """Get the genus read counts and their relative abundances."""
+    df = pd.read_csv(
+        "data/genera.csv",
+        usecols=["samples", "genus", "reads"],
+        dtype={"samples": str, "genus": str},
+    )
+    df["name"] = df.genus
+    totals = df.groupby("samples").reads.sum()
+    df["relative"] = df.reads / totals[df.samples].values
+    return df
+
+
+@table(["data/fluxes", "data/genera.csv", "data/recent.csv"])
+def exchange_fluxes():
+    """Get the non-zero exchange fluxes of all taxa with their abundances.
+
+    Only includes samples in `data/recent.csv`. The total flux is the
+    flux weighted by the relative abundance of the taxon.
+    """
+    store = FluxStore("data/fluxes")
+    index = samples().index
+    fluxes = store.query(
+        index[index.isin(store.samples)],
+        prefix="EX_",
+        suffix="(e)",
+        exclude=["medium"],
+    ).astype({"sample": str, "compartment": str, "reaction": str})
+    fluxes["taxa"] = fluxes.compartment + "_" + fluxes["sample"]
+    fluxes["name"] = fluxes.compartment.str.replace("_", " ")
+    fluxes = pd.merge(
+        fluxes,
+        genera(),
+        left_on=["sample", "name"],
+        right_on=["samples", "name"],
+    )
+    fluxes["tot_flux"] = fluxes.flux * fluxes.relative
+    return fluxes
+
+
+@table(["data/fluxes", "data/genera.csv", "data/recent.csv"])
+def taxa():
+    """Get all taxa in the communities with their relative abundance.
+
+    This includes taxa without any stored flux.
+    """
+    store = FluxStore("data/fluxes")
+    index = samples().index
+    df = store.compartments(index[index.isin(store.samples)])
+    df["name"] = df.compartment.str.replace("_", " ")
+    df = pd.merge(
+        df, genera(), left_on=["sample", "name"], right_on=["samples", "name"]
+    )
+    return df[["sample", "name", "relative"]]
+
+
+@table(lambda ids: ["data/elasticities_%s.csv" % i for i in ids])
+def elasticities(ids):
+    """Get the forward elasticities for several samples."""
+    elast = []
+    for sa in ids:
+        e = pd.read_csv("data/elasticities_" + sa + ".csv")
+        e["id"] = sa
+        elast.append(e)
+    elast = pd.concat(elast)
+    return elast[elast.direction == "forward"]
@@ -1,5 +1,5 @@
 import pandas as pd
-import micom
+from catalog import load_catalog
 
 keep = [
     "samples",
@@ -19,21 +19,24 @@ keep = [
     "relative",
 ]
 
+try:
+    chunk_size = snakemake.config.get("abundance_chunk", 1000000)
+except NameError:
+    chunk_size = 1000000
 
-def reduce_group(df):
-    new = df.iloc[0, :]
-    new["file"] = "|".join(df.id.apply(lambda id: f"{id}.xml"))
-    return new
+agora_genus = load_catalog("genus")
 
+# Sum up the abundances for each genus and sample one chunk at a time
+genera = []
+for chunk in pd.read_csv(
+    "data/abundances.csv",
+    usecols=["id", "genus", "reads", "relative"],
+    chunksize=chunk_size,
+):
+    chunk = chunk[chunk.genus.isin(agora_genus.index)]
+    genera.append(chunk.groupby(["id", "genus"]).sum())
+genera = pd.concat(genera).groupby(level=["id", "genus"]).sum()
+genera = genera.reset_index().rename(columns={"id": "samples"})
 
-agora = micom.data.agora
-agora_genus = agora.groupby("genus").apply(reduce_group).reset_index(drop=True)
-
-genera = pd.read_csv("data/abundances.csv")
-genera = genera.groupby(["id", "genus"]).sum().reset_index()
-
-genus_models = pd.merge(genera, agora_genus, on="genus", suffixes=["_x", ""])
-genus_models = genus_models.rename(
-    columns={"id_x": "samples", "mclass": "class"}
-)[keep]
-genus_models.to_csv("data/genera.csv", index=False)
+genus_models = genera.join(agora_genus, on="genus", how="inner")
+genus_models[keep].to_csv("data/genera.csv", index=False)
@@ -1,18 +1,11 @@
 import pandas as pd
 import numpy as np
 from plotnine import *
-from scipy.stats import pearsonr
+import figure_data
 
 theme_set(theme_minimal())
 
-rates = (
-    pd.read_csv("data/tradeoff.csv")
-    .dropna(subset=["abundance"])
-    .rename(columns={"sample": "id", "compartments": "genus"})
-)
-
-rates["log_rates"] = np.log10(rates.growth_rate)
-rates.loc[rates.growth_rate <= 0, "log_rates"] = -16
+rates = figure_data.rates()
 
 pos = rates.query("growth_rate > 1e-6 and tradeoff == 0.5")
 o = pos.groupby("genus").log_rates.mean().sort_values().index
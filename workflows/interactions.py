@@ -0,0 +1,151 @@
+"""Streaming aggregation of knockout results into an interaction network.
+
+Knockout tables have one row per knocked taxon and one column per affected
+taxon for every sample, so they grow with the square of the number of
+taxa. Here they are read in chunks and only the observed changes are kept
+as a sparse knocked x affected x sample structure. Counts, means and the
+number of strong interactions for every pair of taxa are updated with every
+chunk, so the network and summary tables never need the full long table.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+def _lookup(index, values):
+    """Get the positions of values in an index, adding new values."""
+    new = pd.Index(pd.unique(values)).difference(index)
+    if len(new) > 0:
+        index = index.append(new)
+    return index, index.get_indexer(values)
+
+
+class KnockoutNetwork(object):
+    """Running statistics for all pairs of knocked and affected taxa.
+
+    Attributes
+    ----------
+    threshold : float
+        Changes with an absolute value larger than this are strong
+        interactions.
+    taxa : pandas.Index
+        All knocked or affected taxa.
+    samples : pandas.Index
+        All samples.
+    n : numpy.ndarray
+        The number of samples in which each pair was observed.
+    total : numpy.ndarray
+        The sum of the changes for each pair.
+    competitive, cooperative : numpy.ndarray
+        The number of samples in which the knockout increased or decreased
+        the growth of the affected taxon by more than the threshold.
+    """
+
+    def __init__(self, threshold=1e-2):
+        """Create an empty network."""
+        self.threshold = threshold
+        self.taxa = pd.Index([], dtype=object)
+        self.samples = pd.Index([], dtype=object)
+        self._pairs = pd.Index([], dtype=np.int64)
+        self.n = np.zeros(0)
+        self.total = np.zeros(0)
+        self.competitive = np.zeros(0)
+        self.cooperative = np.zeros(0)
+        self._observations = []
+
+    def add(self, ko):
+        """Add knockout results.
+
+        Arguments
+        ---------
+        ko : pandas.DataFrame
+            The knockout results for one or more samples as saved by the
+            knockout analyses, with the knocked taxa as index, one column
+            for every affected taxon and a "sample" column. Missing values
+            mean the affected taxon was not present.
+        """
+        changes = ko.drop(columns="sample")
+        values = changes.values.astype(float)
+        rows, cols = np.nonzero(~np.isnan(values))
+        values = values[rows, cols]
+        self.taxa, knocked = _lookup(self.taxa, changes.index.values)
+        self.taxa, affected = _lookup(self.taxa, changes.columns.values)
+        self.samples, samples = _lookup(self.samples, ko["sample"].values)
+        keys = (knocked[rows].astype(np.int64) << 32) | affected[cols]
+        self._pairs, pairs = _lookup(self._pairs, keys)
+
+        size = len(self._pairs)
+
+        def update(current, weights=None):
+            counts = np.bincount(pairs, weights=weights, minlength=size)
+            return np.append(current, np.zeros(size - len(current))) + counts
+
+        self.n = update(self.n)
+        self.total = update(self.total, values)
+        self.competitive = update(self.competitive, values > self.threshold)
+        self.cooperative = update(self.cooperative, values < -self.threshold)
+        self._observations.append(
+            (pairs.astype(np.int32), samples[rows].astype(np.int32), values)
+        )
+
+    @classmethod
+    def from_csv(cls, filename, threshold=1e-2, chunksize=100000):
+        """Read a combined knockout table in chunks."""
+        network = cls(threshold)
+        for chunk in pd.read_csv(filename, index_col=0, chunksize=chunksize):
+            network.add(chunk)
+        return network
+
+    def edges(self):
+        """Get the statistics for every observed pair of taxa.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per pair with the knocked taxon, the affected "genus",
+            the number of samples "n", the mean "change", the number of
+            competitive and cooperative interactions and the "prevalence"
+            (the number of samples with a strong interaction).
+        """
+        keys = self._pairs.values
+        n = self.n.astype(int)
+        df = pd.DataFrame(
+            {
+                "knocked": self.taxa.values[keys >> 32],
+                "genus": self.taxa.values[keys & 0xFFFFFFFF],
+                "n": n,
+                "change": self.total / np.maximum(n, 1),
+                "competitive": self.competitive.astype(int),
+                "cooperative": self.cooperative.astype(int),
+            }
+        )
+        df["prevalence"] = df.competitive + df.cooperative
+        return df
+
+    def matrix(self):
+        """Get the changes as a sparse pairs x samples matrix.
+
+        Rows are in the same order as in `edges`. Only observed changes are
+        stored, which may include explicit zeros.
+        """
+        shape = (len(self._pairs), len(self.samples))
+        if len(self._observations) == 0:
+            return csr_matrix(shape)
+        pairs, samples, values = (
+            np.concatenate(x) for x in zip(*self._observations)
+        )
+        return csr_matrix((values, (pairs, samples)), shape=shape)
+
+    def counts(self):
+        """Get the number of strong interactions for every knocked taxon.
+
+        Only includes knocked taxa with at least one strong interaction.
+        """
+        edges = self.edges()
+        counts = edges.groupby("knocked")[["competitive", "cooperative"]]
+        counts = counts.sum()
+        counts = counts[counts.sum(axis=1) > 0].reset_index()
+        return counts.melt(
+            id_vars="knocked", var_name="type", value_name="counts"
+        )
@@ -5,32 +5,33 @@ import networkx as nx
 import nxviz
 import matplotlib.pyplot as plt
 from plotnine import *
+from permutation import adjust_fdr, sign_flip_test
+from interactions import KnockoutNetwork
 
 theme_set(theme_minimal())
+try:
+    max_procs = snakemake.threads
+    permutations = snakemake.config.get("permutations", 9999)
+except NameError:
+    max_procs = 20
+    permutations = 9999
 
-ko = pd.read_csv("data/knockouts.csv", index_col=0)
-ko["knocked"] = ko.index
-ko = ko.melt(
-    id_vars=["knocked", "sample"], var_name="genus", value_name="change"
-).dropna()
+network = KnockoutNetwork.from_csv("data/knockouts.csv", threshold=1e-2)
+edges = network.edges()
+others = (edges.knocked != edges.genus).values
 
-pos = ko.groupby(["knocked", "genus"]).change.mean().reset_index()
-pos = pos[pos.knocked != pos.genus].sort_values(by="knocked")
-counts = (
-    ko[ko.change.abs() > 1e-2]
-    .groupby("knocked")
-    .apply(
-        lambda df: pd.DataFrame(
-            {
-                "counts": [
-                    df.change[df.change > 0].count(),
-                    df.change[df.change < 0].count(),
-                ],
-                "type": ["competitive", "cooperative"],
-            }
-        )
-    )
-).reset_index()
+# Test every interaction against random sign flips of the whole samples
+pos = edges[others].reset_index(drop=True)
+tests = sign_flip_test(network.matrix()[others], permutations, max_procs)
+pos["p"] = tests.p.values
+pos["q"] = adjust_fdr(pos.p)
+pos = pos.sort_values(by="knocked")
+pos.to_csv("data/interaction_significance.csv", index=False)
+print(
+    "%d of %d interactions are significant (FDR < 0.05)."
+    % ((pos.q < 0.05).sum(), len(pos))
+)
+counts = network.counts()
 counts = counts.sort_values(by="counts", ascending=False)
 counts.knocked = pd.Categorical(
     counts.knocked, counts.knocked.unique()[::-1], ordered=True
@@ -46,7 +47,10 @@ pl = (
 pl.save("figures/knockout_counts.svg", width=4, height=12)
 
 graph = nx.from_pandas_edgelist(
-    pos[pos.change.abs() > 1e-2], "knocked", "genus", "change"
+    pos[(pos.change.abs() > 1e-2) & (pos.q < 0.05)],
+    "knocked",
+    "genus",
+    "change",
 )
 
 for idx, _ in graph.nodes(data=True):
@@ -67,12 +71,7 @@ plt.tight_layout(rect=[0.05, 0.15, 0.7, 0.8])
 plt.savefig("figures/circos.svg")
 plt.close()
 
-ns = (
-    ko[(ko.change.abs() > 1e-2) & (ko.knocked != ko.genus)]
-    .groupby(["genus", "knocked"])
-    .sample.count()
-    .reset_index()
-)
+ns = pos[pos.prevalence > 0].rename(columns={"prevalence": "sample"})
 
 pl = (
     ggplot(ns, aes(x="sample"))
@@ -1,26 +1,45 @@
-"""Perform taxa knockouts."""
+"""Perform taxa knockouts.
+
+Knockouts for large communities are split across several workers.
+"""
 
 import pandas as pd
 import micom
-from micom import load_pickle
-from micom.media import minimal_medium
-from micom.workflows import workflow
+from model_store import load_community
+from analyses import knockouts, knockout_tasks, task_id, collect_knockouts
+from results import ResultStore
+from pool import pool_options, run, run_name
 
 logger = micom.logger.logger
 logger.add("micom.log")
 try:
     max_procs = snakemake.threads
+    config = snakemake.config
+    chunk_size = snakemake.config.get("knockout_chunk", 8)
 except NameError:
     max_procs = 20
+    config = {}
+    chunk_size = 8
+
+kos = ResultStore("data/knockouts")
+parts = ResultStore("data/knockouts/parts")
 
 
-def knockout(sam):
-    com = load_pickle("data/models/" + sam + ".pickle")
-    ko = com.knockout_species(fraction=0.5)
-    ko["sample"] = sam
-    return ko
+def knockout(task):
+    sam, taxa = task
+    com = load_community(sam)
+    store = kos if taxa is None else parts
+    store.write(task_id(task), knockouts(com, sam, taxa))
 
 
 samples = pd.read_csv("data/recent.csv")
-kos = workflow(knockout, samples.run_accession, max_procs)
-pd.concat(kos).to_csv("data/knockouts.csv")
+tasks = knockout_tasks(samples.run_accession, chunk_size)
+run(
+    knockout,
+    tasks,
+    max_procs,
+    name=run_name("knockouts", samples.run_accession),
+    **pool_options(config)
+)
+collect_knockouts(parts, kos, tasks)
+kos.combine("data/knockouts.csv", samples.run_accession)
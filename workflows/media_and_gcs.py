@@ -2,57 +2,48 @@
 
 import pandas as pd
 import micom
-from micom import load_pickle
-from micom.media import minimal_medium
-from micom.workflows import workflow
-from micom.logger import logger
+from model_store import load_community
+from analyses import media_and_gcs
+from media_cache import cache_options
+from results import FluxStore, ResultStore
+from pool import pool_options, run, run_name
 
 
 logger = micom.logger.logger
 logger.add("micom.log")
 try:
     max_procs = snakemake.threads
+    config = snakemake.config
 except NameError:
     max_procs = 20
+    config = {}
 
+stores = {
+    "gcs": ResultStore("data/growth_rates"),
+    "medium": ResultStore("data/minimal_imports"),
+}
+sparse_fluxes = FluxStore("data/fluxes")
 
-def media_and_gcs(sam):
-    com = load_pickle("data/models/" + sam + ".pickle")
 
-    # Get growth rates
-    try:
-        sol = com.cooperative_tradeoff(fraction=0.5)
-        rates = sol.members["growth_rate"].copy()
-        rates["community"] = sol.growth_rate
-        rates.name = sam
-    except Exception:
-        logger.warning("Could not solve cooperative tradeoff for %s." % sam)
-        return None
-
-    # Get the minimal medium
-    med = minimal_medium(com, 0.95 * sol.growth_rate, exports=True)
-    med.name = sam
-
-    # Apply medium and reoptimize
-    com.medium = med[med > 0]
-    sol = com.cooperative_tradeoff(fraction=0.5, fluxes=True, pfba=False)
-    fluxes = sol.fluxes
-    fluxes["sample"] = sam
-    return {"medium": med, "gcs": rates, "fluxes": fluxes}
+def media_worker(sam):
+    com = load_community(sam)
+    results = media_and_gcs(com, sam, **cache_options(config))
+    for name, store in stores.items():
+        store.write(sam, results[name])
+    sparse_fluxes.write(sam, results["fluxes"])
 
 
 samples = pd.read_csv("data/recent.csv")
-gcs = pd.DataFrame()
-media = pd.DataFrame()
-fluxes = pd.DataFrame()
-
-results = workflow(media_and_gcs, samples.run_accession, max_procs)
-
-for r in results:
-    gcs = gcs.append(r["gcs"])
-    media = media.append(r["medium"])
-    fluxes = fluxes.append(r["fluxes"])
-
-gcs.to_csv("data/growth_rates.csv")
-media.to_csv("data/minimal_imports.csv")
-fluxes.to_csv("data/minimal_fluxes.csv.gz", compression="gzip")
+run(
+    media_worker,
+    samples.run_accession,
+    max_procs,
+    name=run_name("media_and_gcs", samples.run_accession),
+    **pool_options(config)
+)
+
+stores["gcs"].combine("data/growth_rates.csv", samples.run_accession)
+stores["medium"].combine("data/minimal_imports.csv", samples.run_accession)
+sparse_fluxes.combine(
+    "data/minimal_fluxes.csv.gz", samples.run_accession, index=False
+)
@@ -0,0 +1,60 @@
+"""A cache of minimal media keyed by community composition and diet.
+
+Communities with the same taxa, abundances, diet and required growth rate
+solve the same minimal medium problem, so it only has to be calculated
+once. Keys use the exact values, so a medium is only reused for an
+identical problem. The cache is off by default.
+"""
+
+import hashlib
+from os.path import isfile
+from results import ResultStore
+
+cache_dir = "data/media_cache"
+
+
+def cache_options(config):
+    """Get the media cache options from a Snakemake config."""
+    if not config.get("media_cache", False):
+        return {"cache": None}
+    return {"cache": cache_dir}
+
+
+def media_key(com, growth):
+    """Get the cache key for the minimal medium of a community.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community with the diet applied.
+    growth : float
+        The required community growth rate.
+
+    Returns
+    -------
+    str
+        The key.
+    """
+    h = hashlib.sha256()
+    abundances = com.abundances
+    for taxon in sorted(abundances.index):
+        h.update(("%s:%r;" % (taxon, float(abundances[taxon]))).encode())
+    h.update(b"|")
+    diet = com.medium
+    for rid in sorted(diet):
+        h.update(("%s:%r;" % (rid, float(diet[rid]))).encode())
+    h.update(("|%r" % float(growth)).encode())
+    return h.hexdigest()
+
+
+def load_medium(key, directory=cache_dir):
+    """Get a cached medium or None if there is none."""
+    store = ResultStore(directory)
+    if not isfile(store.path(key)):
+        return None
+    return store.read([key]).iloc[0].dropna()
+
+
+def save_medium(key, medium, directory=cache_dir):
+    """Save a medium to the cache."""
+    ResultStore(directory).write(key, medium)
@@ -0,0 +1,49 @@
+"""Fold new or changed per-sample results into the combined tables.
+
+Snakemake removes the outputs of a job before running it, so the merged
+tables are kept in `data/merged` and only linked to the output files.
+"""
+
+import os
+from os import makedirs
+from os.path import basename, dirname, isfile, join, splitext
+from shutil import copyfile
+import pandas as pd
+import micom
+from results import ResultStore
+
+logger = micom.logger.logger
+logger.add("micom.log")
+
+try:
+    merges = [(snakemake.input, snakemake.output[0])]
+except NameError:
+    samples = pd.read_csv("data/recent.csv").run_accession
+    merges = [
+        (["data/%s/%s.parquet" % (name, s) for s in samples], out)
+        for name, out in [
+            ("tradeoff", "data/tradeoff.csv"),
+            ("growth_rates", "data/growth_rates.csv"),
+            ("minimal_imports", "data/minimal_imports.csv"),
+            ("fluxes", "data/minimal_fluxes.csv.gz"),
+            ("knockouts", "data/knockouts.csv"),
+        ]
+    ]
+
+makedirs("data/merged", exist_ok=True)
+for shards, out in merges:
+    store = ResultStore(dirname(shards[0]))
+    samples = [splitext(basename(s))[0] for s in shards]
+    merged_file = join("data/merged", basename(out))
+    # long flux tables have no meaningful index
+    kwargs = {"index": False} if "fluxes" in basename(out) else {}
+    merged = store.merge(merged_file, samples, **kwargs)
+    logger.info(
+        "merged %d/%d samples into %s." % (len(merged), len(samples), out)
+    )
+    if isfile(out):
+        os.remove(out)
+    try:
+        os.link(merged_file, out)
+    except OSError:
+        copyfile(merged_file, out)
@@ -0,0 +1,108 @@
+"""Optional instrumentation of the analysis phases.
+
+Records the wall time, the number of solver calls and iterations and the
+memory of the worker for every phase of a task. Recording is disabled
+by default and can be turned on with `--config metrics=True` or by setting
+the environment variable `WORKFLOW_METRICS`. The records of all tasks are
+collected by `pool.run`, and `combine` joins the tables of per-sample
+Snakemake jobs into one table per rule.
+"""
+
+from contextlib import contextmanager
+from os import environ
+from os.path import isfile, join
+from resource import getrusage, RUSAGE_SELF
+import time
+import pandas as pd
+from cobra.util.solver import interface_to_str
+
+enabled = bool(environ.get("WORKFLOW_METRICS"))
+records = []
+
+
+def _iterations(solver):
+    """Get the number of iterations used by the last solve."""
+    try:
+        interface = interface_to_str(solver.interface)
+        problem = solver.problem
+        if interface == "cplex":
+            progress = problem.solution.progress
+            return (
+                progress.get_num_iterations()
+                + progress.get_num_barrier_iterations()
+            )
+        if interface == "gurobi":
+            return int(problem.IterCount + problem.BarIterCount)
+    except Exception:
+        pass
+    return 0
+
+
+@contextmanager
+def phase(name, sample, com=None):
+    """Measure a single phase of a task.
+
+    Arguments
+    ---------
+    name : str
+        The name of the phase.
+    sample : str
+        The sample the phase runs on.
+    com : micom.Community, optional
+        If given, counts the solver calls and iterations for the community.
+
+    Memory is given as the peak of the worker process at the end of the
+    phase and by how much the phase raised that peak. The process peak
+    can not go down, so phases after a large one only show the increase.
+
+    """
+    if not enabled:
+        yield None
+        return
+    record = {"sample": sample, "phase": name, "solves": 0, "iterations": 0}
+    if com is not None:
+        solver = com.solver
+        optimize = solver.optimize
+
+        def counted_optimize():
+            status = optimize()
+            record["solves"] += 1
+            record["iterations"] += _iterations(solver)
+            return status
+
+        solver.optimize = counted_optimize
+    start = time.perf_counter()
+    start_rss = getrusage(RUSAGE_SELF).ru_maxrss
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        peak_rss = getrusage(RUSAGE_SELF).ru_maxrss
+        record["process_peak_mb"] = peak_rss / 1024
+        record["peak_increase_mb"] = (peak_rss - start_rss) / 1024
+        if com is not None:
+            del solver.optimize
+        records.append(record)
+
+
+def combine(name, samples, directory="data/metrics"):
+    """Join the metrics of per-sample jobs into a single table.
+
+    The tables `<name>_<sample>.csv` are combined into `<name>.csv`. An
+    existing `<name>.csv` is kept if there are no per-sample tables.
+
+    Returns
+    -------
+    str
+        The combined table.
+    """
+    out = join(directory, name + ".csv")
+    files = [join(directory, "%s_%s.csv" % (name, s)) for s in samples]
+    files = [f for f in files if isfile(f)]
+    if len(files) > 0:
+        pd.concat([pd.read_csv(f) for f in files], sort=False).to_csv(
+            out, index=False
+        )
+    elif not isfile(out):
+        pd.DataFrame(columns=["sample", "phase"]).to_csv(out, index=False)
+    return out
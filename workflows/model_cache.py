@@ -0,0 +1,90 @@
+"""A content-addressed on-disk cache of parsed taxon models.
+
+Models are keyed by the SHA-256 hashes of their source files, so the same
+AGORA models are only parsed once no matter how many samples or build rules
+use them. The cache is safe to share between several worker processes.
+"""
+
+import fcntl
+import hashlib
+import os
+from os import makedirs
+from os.path import isfile, join
+import pickle
+import tempfile
+import micom
+from micom.util import join_models, load_model
+
+logger = micom.logger.logger
+cache_dir = "data/agora_cache"
+_digests = {}
+
+
+def file_digest(filename):
+    """Get the SHA-256 hash of a file's content.
+
+    Hashes are memoized for the lifetime of the process as long as the size
+    and modification time of the file do not change.
+    """
+    st = os.stat(filename)
+    key = (filename, st.st_size, st.st_mtime)
+    if key not in _digests:
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def model_key(files):
+    """Get the cache key for a taxon model assembled from several files.
+
+    The order of the files matters since `join_models` uses the first model
+    as base.
+    """
+    h = hashlib.sha256()
+    for f in files:
+        h.update(file_digest(f).encode())
+    return h.hexdigest()
+
+
+def cached_model(files, directory=cache_dir):
+    """Get the cached and pickled model for a taxon.
+
+    Parses and joins the model files on a cache miss. Concurrent workers
+    requesting the same model will wait for the first one to finish instead
+    of parsing it again.
+
+    Arguments
+    ---------
+    files : list of str
+        The SBML files that make up the taxon model.
+    directory : str
+        The cache directory.
+
+    Returns
+    -------
+    str
+        The path to the pickled model which can be used in the "file" column
+        of a micom taxonomy.
+
+    """
+    makedirs(directory, exist_ok=True)
+    filename = join(directory, model_key(files) + ".pickle")
+    if isfile(filename):
+        return filename
+    with open(filename + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not isfile(filename):
+            logger.info("caching model for %s." % ", ".join(files))
+            if len(files) > 1:
+                model = join_models(files)
+            else:
+                model = load_model(files[0])
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as out:
+                pickle.dump(model, out, protocol=2)
+            os.replace(tmp, filename)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return filename
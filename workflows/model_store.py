@@ -0,0 +1,118 @@
+"""Saving and loading the community models of the samples.
+
+Every community is stored as a pickle `<sample>.pickle` with a small JSON
+file `<sample>.taxa.json` holding the taxon abundances, so tasks can be
+planned without unpickling the model. All analyses load their models
+through `load_community`.
+
+Samples can also be saved as a small JSON descriptor `<sample>.json` that
+points to a template community shared by all samples with the same taxa
+and only holds the sample's abundances. Those are applied to the template
+when the sample is loaded.
+"""
+
+import json
+from os.path import isfile, join, relpath
+import pandas as pd
+import micom
+from micom import load_pickle
+from metrics import phase
+import pool
+from solving import use_fallback
+
+logger = micom.logger.logger
+
+
+def save_taxa(com, filename):
+    """Save the taxon abundances of a community next to its pickle."""
+    with open(filename.replace(".pickle", ".taxa.json"), "w") as out:
+        json.dump(com.abundances.to_dict(), out)
+
+
+def save_sample(sam, template, abundances, directory="data/models"):
+    """Save a sample as a template community and its abundances.
+
+    Arguments
+    ---------
+    sam : str
+        The sample name.
+    template : str
+        The pickle of the template community.
+    abundances : pandas.Series
+        The abundance of every taxon in the template. Does not need to be
+        normalized.
+    directory : str
+        The model directory.
+    """
+    descriptor = {
+        "id": sam,
+        "template": relpath(template, directory),
+        "abundances": abundances.astype(float).to_dict(),
+    }
+    with open(join(directory, sam + ".json"), "w") as out:
+        json.dump(descriptor, out)
+
+
+def save_reduction(reduction, filename):
+    """Save the reaction mapping of a reduced community next to its pickle.
+
+    See `reduction.reduce_community` for the format.
+    """
+    with open(filename.replace(".pickle", ".reduction.json"), "w") as out:
+        json.dump(reduction, out)
+
+
+def _read_pickle(filename):
+    """Load a community from its pickle.
+
+    Reduced communities get their reaction mapping as `com.reduction`.
+    """
+    com = load_pickle(filename)
+    reduction = filename.replace(".pickle", ".reduction.json")
+    if isfile(reduction):
+        with open(reduction) as f:
+            com.reduction = json.load(f)
+    return com
+
+
+def load_community(sam, directory="data/models"):
+    """Load the community for a sample.
+
+    Samples saved as descriptors get their abundances applied to the
+    template community. Retries of failed tasks get the solver settings for
+    their attempt.
+    """
+    descriptor = join(directory, sam + ".json")
+    with phase("load", sam):
+        if isfile(descriptor):
+            with open(descriptor) as f:
+                meta = json.load(f)
+            com = _read_pickle(join(directory, meta["template"]))
+            com.id = sam
+            abundances = pd.Series(meta["abundances"])
+            com.set_abundance(abundances / abundances.sum())
+        else:
+            com = _read_pickle(join(directory, sam + ".pickle"))
+    return use_fallback(com, pool.attempt)
+
+
+def has_model(sam, directory="data/models"):
+    """Check whether a model has been built for a sample."""
+    suffixes = [".json", ".pickle"]
+    return any(isfile(join(directory, sam + s)) for s in suffixes)
+
+
+def load_taxa(sam, directory="data/models"):
+    """Get the taxa in a sample's community without loading the model.
+
+    Returns None if the taxa of the model have not been saved.
+    """
+    descriptor = join(directory, sam + ".json")
+    taxa = join(directory, sam + ".taxa.json")
+    if isfile(descriptor):
+        with open(descriptor) as f:
+            return list(json.load(f)["abundances"])
+    if isfile(taxa):
+        with open(taxa) as f:
+            return list(json.load(f))
+    return None
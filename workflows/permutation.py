@@ -0,0 +1,247 @@
+"""Vectorized permutation tests that run in parallel.
+
+Permutations are drawn in batches and every batch is evaluated with a few
+matrix products instead of one statistic at a time. Batches run in
+separate worker processes via `pool.run`. All functions passed to the
+workers are module-level functions with their data bound by
+`functools.partial`, so they can be pickled for any multiprocessing start
+method. Only the number of null statistics exceeding the observed ones is
+sent back, so memory does not grow with the number of permutations.
+"""
+
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, diags, issparse
+from pool import run
+
+max_block = 10000000
+"""Maximum number of entries in the intermediate matrices of a block."""
+
+
+def _count_exceeding(statistic, observed, batch):
+    """Count the null statistics of a batch that exceed the observed ones."""
+    size, seed = batch
+    rng = np.random.RandomState(seed)
+    null = statistic(rng, size).reshape(size, -1)
+    # tolerance for ties from floating point differences
+    return (null >= observed - 1e-10 * np.abs(observed)).sum(axis=0)
+
+
+def permutation_test(
+    statistic,
+    observed,
+    permutations=9999,
+    processes=1,
+    batch_size=1000,
+    seed=42,
+):
+    """Get permutation p-values for one or several statistics.
+
+    Arguments
+    ---------
+    statistic : function
+        A function `statistic(rng, size)` that returns the statistics for
+        `size` random permutations drawn from the `numpy.random.RandomState`
+        `rng` as an array with shape (size, k). Must be picklable, so use
+        a module-level function and bind its data with `functools.partial`.
+    observed : float or array-like of length k
+        The observed statistics. Larger values are more extreme.
+    permutations : positive int
+        The number of permutations.
+    processes : positive int
+        How many batches to run in parallel.
+    batch_size : positive int
+        The number of permutations in a single batch.
+    seed : int
+        The seed for the permutations. Every batch gets its own seed derived
+        from this one, so results do not depend on `processes`.
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, int)
+        The p-values for all statistics and the number of permutations
+        that were actually run. Batches that failed are left out.
+    """
+    observed = np.atleast_1d(np.asarray(observed, dtype=float))
+    sizes = [batch_size] * (permutations // batch_size)
+    if permutations % batch_size > 0:
+        sizes.append(permutations % batch_size)
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=len(sizes))
+    counts = run(
+        partial(_count_exceeding, statistic, observed),
+        list(zip(sizes, seeds)),
+        min(processes, len(sizes)),
+        unit="batch(es)",
+    )
+    done = sum(s for s, c in zip(sizes, counts) if c is not None)
+    exceed = sum((c for c in counts if c is not None), np.zeros(len(observed)))
+    return (exceed + 1.0) / (done + 1.0), done
+
+
+def adjust_fdr(pvalues):
+    """Adjust p-values with the Benjamini-Hochberg procedure."""
+    pvalues = np.asarray(pvalues, dtype=float)
+    order = np.argsort(pvalues)[::-1]
+    ranked = pvalues[order] * len(pvalues) / np.arange(len(pvalues), 0, -1)
+    adjusted = np.empty_like(pvalues)
+    adjusted[order] = np.minimum.accumulate(np.minimum(ranked, 1.0))
+    return adjusted
+
+
+def _group_sums_sq(mat, labels, n_groups):
+    """Get the squared norms of the group sums for many labelings.
+
+    `labels` has one labeling per row and the result one row of group
+    norms per labeling.
+    """
+    size, n = labels.shape
+    rows = (labels + n_groups * np.arange(size)[:, None]).ravel()
+    indicator = csr_matrix(
+        (np.ones(rows.size), (rows, np.tile(np.arange(n), size))),
+        shape=(size * n_groups, n),
+    )
+    sums = indicator @ mat
+    if issparse(sums):
+        sums_sq = np.asarray(sums.multiply(sums).sum(axis=1)).ravel()
+    else:
+        sums_sq = (sums ** 2).sum(axis=1)
+    return sums_sq.reshape(size, n_groups)
+
+
+def _pseudo_f(mat, row_sq, total, sizes, labels):
+    """Get the PERMANOVA pseudo-F for one labeling per row of `labels`."""
+    n, a = labels.shape[1], len(sizes)
+    within = row_sq - (_group_sums_sq(mat, labels, a) / sizes).sum(axis=1)
+    return ((total - within) / (a - 1)) / (within / (n - a))
+
+
+def _permanova_null(mat, row_sq, total, sizes, labels, block, rng, size):
+    """Get the pseudo-F for `size` random permutations of the labels."""
+    null = []
+    for start in range(0, size, block):
+        m = min(block, size - start)
+        lab = np.array([rng.permutation(labels) for _ in range(m)])
+        null.append(_pseudo_f(mat, row_sq, total, sizes, lab))
+    return np.concatenate(null)
+
+
+def permanova(
+    mat, grouping, permutations=9999, processes=1, batch_size=1000, seed=42
+):
+    """Run PERMANOVA on the Euclidean distances between rows.
+
+    Uses the identity between sums of squared Euclidean distances and
+    sums of squares around centroids, so the distance matrix is never
+    built. The result is laid out like `skbio.stats.distance.permanova`.
+
+    Arguments
+    ---------
+    mat : numpy.ndarray or scipy.sparse matrix
+        The profiles with one row per object.
+    grouping : array-like
+        The group of each row.
+    permutations : int
+        The number of permutations for the p-value.
+    processes : positive int
+        How many batches of permutations to run in parallel.
+    batch_size : positive int
+        The number of permutations per batch.
+    seed : int
+        The seed for the permutations.
+
+    Returns
+    -------
+    pandas.Series
+        The PERMANOVA results.
+    """
+    labels, groups = pd.factorize(np.asarray(grouping))
+    n, a = len(labels), len(groups)
+    if issparse(mat):
+        mat = csr_matrix(mat, dtype=float)
+        row_sq = mat.multiply(mat).sum()
+        mean = np.asarray(mat.mean(axis=0)).ravel()
+    else:
+        mat = np.asarray(mat, dtype=float)
+        row_sq = (mat ** 2).sum()
+        mean = mat.mean(axis=0)
+    total = row_sq - n * (mean ** 2).sum()
+    sizes = np.bincount(labels, minlength=a)
+    block = max(1, int(max_block // (a * mat.shape[1])))
+    stat = _pseudo_f(mat, row_sq, total, sizes, labels[None, :])[0]
+    statistic = partial(
+        _permanova_null, mat, row_sq, total, sizes, labels, block
+    )
+    p, done = permutation_test(
+        statistic, stat, permutations, processes, batch_size, seed
+    )
+    return pd.Series(
+        ["PERMANOVA", "pseudo-F", n, a, stat, p[0], done],
+        index=[
+            "method name",
+            "test statistic name",
+            "sample size",
+            "number of groups",
+            "test statistic",
+            "p-value",
+            "number of permutations",
+        ],
+        name="PERMANOVA results",
+    )
+
+
+def _sign_flip_null(x, block, rng, size):
+    """Get the absolute means for `size` random sign flips of the columns."""
+    null = []
+    for start in range(0, size, block):
+        m = min(block, size - start)
+        signs = rng.randint(2, size=(x.shape[1], m)) * 2.0 - 1.0
+        null.append(np.abs(x @ signs).T)
+    return np.concatenate(null)
+
+
+def sign_flip_test(
+    values, permutations=9999, processes=1, batch_size=1000, seed=42
+):
+    """Test whether the means of several variables differ from zero.
+
+    The null distribution is obtained by flipping the signs of whole
+    columns (for instance samples), so every variable is tested with the
+    observations it has and the dependencies between variables are kept.
+
+    Arguments
+    ---------
+    values : pandas.DataFrame or scipy.sparse matrix
+        The observations with one row per variable and one column per
+        independent unit. Missing observations are NaN in a data frame and
+        not stored in a sparse matrix.
+    permutations, processes, batch_size, seed
+        As for `permutation_test`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The mean, number of observations and two-sided p-value for every
+        variable.
+    """
+    if issparse(values):
+        x = csr_matrix(values, dtype=float)
+        counts = np.diff(x.indptr)
+        x = diags(1.0 / np.maximum(counts, 1)) @ x
+        index = None
+    else:
+        counts = values.notna().sum(axis=1).values
+        x = values.fillna(0.0).values / np.maximum(counts, 1)[:, None]
+        index = values.index
+    means = np.asarray(x.sum(axis=1)).ravel()
+    observed = np.abs(means)
+    block = max(1, int(max_block // x.shape[0]))
+    p, _ = permutation_test(
+        partial(_sign_flip_null, x, block),
+        observed,
+        permutations,
+        processes,
+        batch_size,
+        seed,
+    )
+    return pd.DataFrame({"mean": means, "n": counts, "p": p}, index=index)
@@ -0,0 +1,212 @@
+"""Run analyses in parallel with per-task limits and retries.
+
+A replacement for `micom.workflows.workflow`. Every task runs in its own
+process which is killed if it exceeds the time limit or its resident memory
+exceeds the memory limit. Tasks that fail are retried with different solver
+settings (see `solving.fallbacks`) and all failures are saved to a table
+instead of stopping the run. If enabled, the phase metrics of all tasks
+(see `metrics.py`) are saved as well.
+"""
+
+from collections import deque
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from os import makedirs, remove
+from os.path import dirname, isfile
+import time
+import traceback
+import pandas as pd
+import psutil
+from tqdm import tqdm
+import micom
+import metrics
+
+logger = micom.logger.logger
+attempt = 0
+"""The attempt for the task running in the current process."""
+
+
+def pool_options(config):
+    """Get the pool options from a Snakemake config."""
+    memory = config.get("task_memory")
+    return {
+        "timeout": config.get("task_timeout"),
+        "max_memory": None if memory is None else int(memory * 1024 ** 3),
+        "retries": config.get("task_retries", 2),
+        "profile": config.get("metrics", metrics.enabled),
+    }
+
+
+def run_name(name, samples):
+    """Get the name for the failure and metrics tables of a script."""
+    if len(samples) == 1:
+        name = name + "_" + samples[0]
+    return name
+
+
+def _save(records, filename):
+    """Save a table or remove an outdated one if there are no records."""
+    if len(records) > 0:
+        makedirs(dirname(filename), exist_ok=True)
+        pd.DataFrame(records).to_csv(filename, index=False)
+    elif isfile(filename):
+        remove(filename)
+
+
+def _rss(pid):
+    """Get the resident memory of a process and its children in bytes."""
+    try:
+        proc = psutil.Process(pid)
+        procs = [proc] + proc.children(recursive=True)
+        return sum(p.memory_info().rss for p in procs)
+    except psutil.NoSuchProcess:
+        return 0
+
+
+def _run(func, arg, task_attempt, conn, use_metrics):
+    """Run a single task in a child process."""
+    global attempt
+    attempt = task_attempt
+    metrics.enabled = use_metrics
+    try:
+        result = func(arg)
+        conn.send(("ok", metrics.records, result))
+    except BaseException as e:
+        error = "%s: %s" % (type(e).__name__, e)
+        conn.send(("error", metrics.records, error, traceback.format_exc()))
+    conn.close()
+
+
+def run(
+    func,
+    args,
+    processes=4,
+    timeout=None,
+    max_memory=None,
+    retries=2,
+    name=None,
+    profile=False,
+    unit="sample(s)",
+):
+    """Run analyses for several samples in parallel.
+
+    Arguments
+    ---------
+    func : function
+        A function that takes a single argument and performs the analysis
+        for a single task.
+    args : array-like object
+        The arguments for each task.
+    processes : positive int
+        How many tasks to run in parallel.
+    timeout : positive float, optional
+        Maximum time in seconds for a single attempt of a task.
+    max_memory : positive int, optional
+        Maximum resident memory in bytes for a single task. It is checked
+        about once per second, so short peaks above it can go unnoticed.
+    retries : int
+        How often to retry a failed task. Every retry uses the next solver
+        settings from `solving.fallbacks`.
+    name : str, optional
+        If given, all failed attempts are saved to
+        `data/failures/<name>.csv`.
+    profile : boolean
+        Whether to record the phase metrics of all tasks in
+        `data/metrics/<name>.csv`.
+    unit : str
+        The unit used for the progress bar.
+
+    Returns
+    -------
+    list
+        The results for each task in the order of `args`. Tasks that failed
+        in all attempts have a result of None.
+    """
+    args = list(args)
+    pending = deque((i, 0) for i in range(len(args)))
+    running = {}
+    results = [None] * len(args)
+    failed = []
+    phases = []
+    progress = tqdm(total=len(args), unit=unit)
+
+    def failure(i, task_attempt, start, error, trace=""):
+        logger.warning(
+            "task %s failed in attempt %d: %s" % (args[i], task_attempt, error)
+        )
+        final = task_attempt >= retries
+        failed.append(
+            {
+                "task": str(args[i]),
+                "attempt": task_attempt,
+                "error": error,
+                "seconds": time.time() - start,
+                "final": final,
+                "traceback": trace,
+            }
+        )
+        if final:
+            progress.update()
+        else:
+            pending.append((i, task_attempt + 1))
+
+    while pending or running:
+        while pending and len(running) < processes:
+            i, task_attempt = pending.popleft()
+            receiver, sender = Pipe(duplex=False)
+            p = Process(
+                target=_run,
+                args=(
+                    func,
+                    args[i],
+                    task_attempt,
+                    sender,
+                    profile,
+                ),
+            )
+            p.start()
+            sender.close()
+            running[receiver] = (p, i, task_attempt, time.time())
+
+        for conn in wait(list(running), timeout=1.0):
+            p, i, task_attempt, start = running.pop(conn)
+            try:
+                status = conn.recv()
+            except EOFError:
+                p.join()
+                status = (
+                    "error",
+                    [],
+                    "worker died with code %s" % p.exitcode,
+                )
+            p.join()
+            for record in status[1]:
+                record["attempt"] = task_attempt
+                phases.append(record)
+            if status[0] == "ok":
+                results[i] = status[2]
+                progress.update()
+            else:
+                failure(i, task_attempt, start, *status[2:])
+
+        now = time.time()
+        for conn, (p, i, task_attempt, start) in list(running.items()):
+            if timeout is not None and now - start > timeout:
+                error = "timeout"
+            elif max_memory is not None and _rss(p.pid) > max_memory:
+                error = "memory limit of %d MB exceeded" % (
+                    max_memory / 1024 ** 2
+                )
+            else:
+                continue
+            p.terminate()
+            p.join()
+            del running[conn]
+            failure(i, task_attempt, start, error)
+    progress.close()
+
+    if name is not None:
+        _save(failed, "data/failures/%s.csv" % name)
+        if profile:
+            _save(phases, "data/metrics/%s.csv" % name)
+    return results
@@ -0,0 +1,128 @@
+"""An index of reaction IDs for grouped flux queries.
+
+Reaction IDs are parsed and matched against metabolite groups only once
+for every unique reaction. Flux tables are then mapped to integer reaction
+codes and all group lookups and sums work on those codes instead of
+running string searches over every row.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+EXCHANGE = re.compile(r"^EX_(.+?)(?:\((\w+)\)|_(\w))$")
+
+
+class ReactionIndex(object):
+    """Map reactions to metabolites, compartments and groups.
+
+    Attributes
+    ----------
+    reactions : pandas.Index
+        The unique reaction IDs. The position of a reaction is its code.
+    metabolites : pandas.Series
+        The exchanged metabolite for each exchange reaction, NaN otherwise.
+    compartments : pandas.Series
+        The compartment of each exchange reaction, NaN otherwise.
+    groups : pandas.Index
+        The group names. The position of a group is its code.
+    membership : scipy.sparse.csr_matrix
+        A reactions x groups matrix indicating group membership.
+    """
+
+    def __init__(self, reactions, groups):
+        """Build the index.
+
+        Arguments
+        ---------
+        reactions : array-like of str
+            The reaction IDs, may contain duplicates.
+        groups : dict
+            Maps group names to either a regular expression that is searched
+            in the reaction IDs or a list of metabolite IDs.
+        """
+        self.reactions = pd.Index(pd.unique(np.asarray(reactions, dtype=str)))
+        parsed = [EXCHANGE.match(r) for r in self.reactions]
+        self.metabolites = pd.Series(
+            [m.group(1) if m else np.nan for m in parsed], index=self.reactions
+        )
+        self.compartments = pd.Series(
+            [(m.group(2) or m.group(3)) if m else np.nan for m in parsed],
+            index=self.reactions,
+        )
+        self.groups = pd.Index(list(groups))
+        columns = []
+        for definition in groups.values():
+            if isinstance(definition, str):
+                pattern = re.compile(definition)
+                member = [bool(pattern.search(r)) for r in self.reactions]
+            else:
+                member = self.metabolites.isin(definition).values
+            columns.append(np.asarray(member, dtype=bool))
+        self.membership = csr_matrix(
+            np.column_stack(columns)
+            if columns
+            else np.zeros((len(self.reactions), 0), dtype=bool)
+        )
+
+    def codes(self, reactions):
+        """Get the integer codes for a column of reaction IDs.
+
+        Unknown reactions get the code -1.
+        """
+        if isinstance(reactions, pd.Series):
+            reactions = reactions.values
+        if isinstance(reactions, pd.Categorical):
+            lookup = self.reactions.get_indexer(reactions.categories)
+            return np.where(reactions.codes < 0, -1, lookup[reactions.codes])
+        return self.reactions.get_indexer(np.asarray(reactions, dtype=str))
+
+    def mask(self, reactions, group):
+        """Get a boolean mask of the rows belonging to a group."""
+        member = self.membership[:, self.groups.get_loc(group)].toarray()
+        member = np.append(member.ravel(), False)
+        return member[self.codes(reactions)]
+
+    def labels(self, reactions):
+        """Get the name of the first group each row belongs to.
+
+        Rows that do not belong to any group are NaN.
+        """
+        member = self.membership.toarray()
+        first = np.full(len(self.reactions) + 1, -1)
+        for g in reversed(range(len(self.groups))):
+            first[:-1][member[:, g]] = g
+        codes = first[self.codes(reactions)]
+        labels = np.append(self.groups.values.astype(object), np.nan)
+        return labels[codes]
+
+    def group_sum(self, df, by, value, reaction="reaction"):
+        """Sum up a value for every group.
+
+        Rows are repeated for every group their reaction belongs to, so
+        groups may overlap.
+
+        Arguments
+        ---------
+        df : pandas.DataFrame
+            The data with a column of reaction IDs.
+        by : list of str
+            Additional columns to group by.
+        value : str
+            The column to sum up.
+        reaction : str
+            The column containing the reaction IDs.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The sums with the columns from `by`, "group" and `value`.
+        """
+        codes = self.codes(df[reaction])
+        known = np.flatnonzero(codes >= 0)
+        rows, groups = self.membership[codes[known]].nonzero()
+        rows = known[rows]
+        long = df[by + [value]].iloc[rows]
+        long["group"] = self.groups.values[groups]
+        return long.groupby(by + ["group"])[value].sum().reset_index()
@@ -0,0 +1,200 @@
+"""Reduce community models before solving.
+
+Reactions that can not carry flux with the medium of the community are
+removed and linear chains of reactions within a taxon are merged into a
+single reaction. Exchanges, biomass reactions and all reactions used in
+constraints other than mass balances are never touched, so growth rates
+and exchange fluxes stay the same.
+
+The reduction is only valid for the medium it was calculated with and media
+that only remove imports from it (like the minimal medium). Fluxes of the
+removed reactions can be recovered with `expand_fluxes`.
+"""
+
+from cobra.flux_analysis import find_blocked_reactions
+import micom
+import numpy as np
+import pandas as pd
+
+logger = micom.logger.logger
+
+
+def protected_reactions(com):
+    """Get the IDs of the reactions that must not be removed or merged."""
+    met_ids = set(m.id for m in com.metabolites)
+    names = set()
+    for const in com.constraints:
+        if const.name not in met_ids:
+            names.update(v.name for v in const.variables)
+    protected = set()
+    for r in com.reactions:
+        if (
+            r.id in names
+            or r.reverse_id in names
+            or r.boundary
+            or r.global_id.startswith("EX_")
+            or r.community_id == "medium"
+            or any(m.compartment == "m" for m in r.metabolites)
+        ):
+            protected.add(r.id)
+    return protected
+
+
+def _scaled_bounds(bounds, factor):
+    """Get the bounds of v such that factor * v is within bounds."""
+    lb, ub = bounds[0] / factor, bounds[1] / factor
+    return (lb, ub) if factor > 0 else (ub, lb)
+
+
+def _merge(keep, remove, met):
+    """Merge two reactions sharing a metabolite into the first one.
+
+    Returns the flux of the removed reaction relative to the kept one.
+    """
+    factor = -keep.metabolites[met] / remove.metabolites[met]
+    lb, ub = _scaled_bounds(remove.bounds, factor)
+    keep.add_metabolites(
+        {m: factor * c for m, c in remove.metabolites.items() if m is not met}
+    )
+    keep.subtract_metabolites({met: keep.metabolites[met]})
+    keep.bounds = (max(keep.lower_bound, lb), min(keep.upper_bound, ub))
+    return factor
+
+
+def compress_chains(com, protected):
+    """Merge reactions connected by metabolites used by only two reactions.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community to reduce. It is modified in place.
+    protected : set of str
+        The reactions that must not be merged.
+
+    Returns
+    -------
+    dict
+        For every kept reaction that absorbed others, a dictionary with the
+        fluxes of the absorbed reactions (by global ID) relative to its own
+        flux.
+    """
+    members = {}
+    changed = True
+    while changed:
+        changed = False
+        for met in list(com.metabolites):
+            if met.model is None or len(met.reactions) != 2:
+                continue
+            keep, remove = sorted(met.reactions, key=lambda r: r.id)
+            if (
+                keep.id in protected
+                or remove.id in protected
+                or keep.community_id != remove.community_id
+            ):
+                continue
+            factor = _merge(keep, remove, met)
+            absorbed = members.setdefault(keep.id, {})
+            absorbed[remove.global_id] = factor
+            for rid, f in members.pop(remove.id, {}).items():
+                absorbed[rid] = factor * f
+            com.remove_reactions([remove])
+            com.remove_metabolites([met])
+            changed = True
+    return members
+
+
+def reduce_community(com, zero_cutoff=None):
+    """Remove blocked reactions and compress linear chains.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community with the medium applied. It is modified in place.
+    zero_cutoff : float, optional
+        Reactions whose flux can not exceed this value are blocked.
+        Defaults to the solver tolerance.
+
+    Returns
+    -------
+    dict
+        The mapping back to the original reactions with the original flux
+        "columns", the "blocked" reactions and the "lumped" reactions as
+        lists of [compartment, reaction ID, kept reaction ID, factor]. IDs
+        are global reaction IDs like in the columns of micom fluxes.
+    """
+    columns = list(pd.Index([r.global_id for r in com.reactions]).unique())
+    n_reactions = len(com.reactions)
+    protected = protected_reactions(com)
+    candidates = [r for r in com.reactions if r.id not in protected]
+    blocked = find_blocked_reactions(
+        com, reaction_list=candidates, zero_cutoff=zero_cutoff, processes=1
+    )
+    blocked = [com.reactions.get_by_id(rid) for rid in blocked]
+    mapping = {
+        "columns": columns,
+        "blocked": [[r.community_id, r.global_id] for r in blocked],
+    }
+    com.remove_reactions(blocked, remove_orphans=True)
+    members = compress_chains(com, protected)
+    mapping["lumped"] = [
+        [
+            com.reactions.get_by_id(keep).community_id,
+            rid,
+            com.reactions.get_by_id(keep).global_id,
+            factor,
+        ]
+        for keep, absorbed in members.items()
+        for rid, factor in absorbed.items()
+    ]
+    logger.info(
+        "reduced %s from %d to %d reactions (%d blocked, %d merged)."
+        % (
+            com.id,
+            n_reactions,
+            len(com.reactions),
+            len(mapping["blocked"]),
+            len(mapping["lumped"]),
+        )
+    )
+    return mapping
+
+
+def expand_fluxes(com, fluxes):
+    """Get the fluxes of a reduced community for the original reactions.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community. Fluxes are returned unchanged if it was not reduced.
+    fluxes : pandas.DataFrame
+        The fluxes as returned by micom with one row per compartment and
+        one column per reaction.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The fluxes with the columns of the original community. Blocked
+        reactions have a flux of zero.
+    """
+    reduction = getattr(com, "reduction", None)
+    if reduction is None:
+        return fluxes
+    values = fluxes.rename_axis("compartment").rename_axis("reaction", axis=1)
+    values = values.stack()
+    lumped = pd.DataFrame(
+        reduction["lumped"],
+        columns=["compartment", "reaction", "keep", "factor"],
+    )
+    kept = pd.MultiIndex.from_arrays([lumped.compartment, lumped.keep])
+    lumped["flux"] = lumped.factor.values * values.reindex(kept).values
+    blocked = pd.DataFrame(
+        reduction["blocked"], columns=["compartment", "reaction"]
+    )
+    blocked["flux"] = 0.0
+    removed = pd.concat([lumped, blocked], sort=False).set_index(
+        ["compartment", "reaction"]
+    )
+    values = pd.concat([values, removed.flux.astype(np.float64)])
+    return values.unstack().reindex(
+        index=fluxes.index, columns=reduction["columns"]
+    )
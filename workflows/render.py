@@ -0,0 +1,124 @@
+"""Render all figures in parallel and only redraw the ones that changed.
+
+Every figure script is keyed by the content of its input files, its own
+source, the source of all workflow modules it imports and the config. Only
+scripts whose key changed or whose figures are missing are run, each in
+its own process. The keys of successful runs are saved in
+`figures/render_keys.json`.
+"""
+
+import ast
+import hashlib
+import json
+from os import listdir
+from os.path import dirname, isdir, isfile, join
+import runpy
+import sys
+from types import SimpleNamespace
+import micom
+from model_cache import file_digest
+from pool import pool_options, run
+
+logger = micom.logger.logger
+logger.add("micom.log")
+key_file = "figures/render_keys.json"
+
+
+def local_modules(script, seen=None):
+    """Get all workflow modules a script imports, directly or indirectly.
+
+    Workflow modules are the Python files in the directory of the script.
+    """
+    seen = set() if seen is None else seen
+    with open(script) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            module = join(dirname(script), name.split(".")[0] + ".py")
+            if isfile(module) and module not in seen:
+                seen.add(module)
+                local_modules(module, seen)
+    return seen
+
+
+def _digests(path):
+    """Get the content hashes of a file or all files in a directory."""
+    if isdir(path):
+        return [(f, _digests(join(path, f))) for f in sorted(listdir(path))]
+    return file_digest(path)
+
+
+def render_key(script, inputs, config):
+    """Get the key for a figure script."""
+    h = hashlib.sha256(repr(sorted(config.items())).encode())
+    for f in [script] + sorted(local_modules(script) - {script}):
+        h.update(file_digest(f).encode())
+    for f in sorted(inputs):
+        h.update(repr((f, _digests(f))).encode())
+    return h.hexdigest()
+
+
+def render(task):
+    """Run a figure script."""
+    script, inputs, outputs, threads = task
+    logger.info("rendering %s." % ", ".join(outputs))
+    shim = SimpleNamespace(
+        input=inputs, output=outputs, threads=threads, config=config
+    )
+    runpy.run_path(
+        script, init_globals={"snakemake": shim}, run_name="__main__"
+    )
+    return True
+
+
+try:
+    max_procs = snakemake.threads
+    config = snakemake.config
+    figures = snakemake.params.figures
+    marker = snakemake.output[0]
+except NameError:
+    max_procs = 8
+    config = {}
+    figures = []
+    marker = "figures/.rendered"
+
+keys = {}
+if isfile(key_file):
+    with open(key_file) as f:
+        keys = json.load(f)
+todo = []
+for script, inputs, outputs in figures:
+    inputs, outputs = list(inputs), list(outputs)
+    key = render_key(script, inputs, config)
+    if keys.get(script) == key and all(isfile(o) for o in outputs):
+        logger.info("figures from %s are up to date." % script)
+        continue
+    keys.pop(script, None)
+    todo.append((script, inputs, outputs, key))
+
+threads = max(1, max_procs // max(len(todo), 1))
+options = pool_options(config)
+options["retries"] = 0
+results = run(
+    render,
+    [(s, i, o, threads) for s, i, o, _ in todo],
+    max_procs,
+    name="figures",
+    unit="script(s)",
+    **options
+)
+for (script, _, _, key), done in zip(todo, results):
+    if done:
+        keys[script] = key
+with open(key_file, "w") as out:
+    json.dump(keys, out, indent=2, sort_keys=True)
+if not all(results):
+    logger.error("some figures failed, see `data/failures/figures.csv`.")
+    sys.exit(1)
+open(marker, "w").close()
@@ -0,0 +1,301 @@
+"""Streaming storage for per-sample results.
+
+Workers write their results as soon as they are done, one Parquet file per
+sample in a directory for each result type. The combined tables that the
+figure scripts use are generated from those files one sample at a time, so
+memory use does not grow with the number of samples. Fluxes are also kept
+in a sparse long format that can be read partially.
+"""
+
+import gzip
+import json
+import os
+from os import makedirs, listdir
+from os.path import isfile, join, splitext
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class ResultStore(object):
+    """A directory of per-sample result tables.
+
+    Attributes
+    ----------
+    directory : str
+        The directory containing one Parquet file per sample.
+    """
+
+    def __init__(self, directory):
+        """Create a new result store."""
+        self.directory = directory
+        makedirs(directory, exist_ok=True)
+
+    def path(self, sample):
+        """Get the file name for a sample."""
+        return join(self.directory, sample + ".parquet")
+
+    def write(self, sample, df):
+        """Save the results for a single sample.
+
+        Series are stored as a single row named by the sample. Files are
+        written atomically so readers never see partial results.
+        """
+        if isinstance(df, pd.Series):
+            df = df.to_frame(sample).T
+        df = df.rename(columns=str)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp)
+        os.replace(tmp, self.path(sample))
+        return self.path(sample)
+
+    @property
+    def samples(self):
+        """list of str: The samples with stored results."""
+        return sorted(
+            splitext(f)[0]
+            for f in listdir(self.directory)
+            if f.endswith(".parquet")
+        )
+
+    def columns(self, samples=None):
+        """Get the union of all columns in order of appearance.
+
+        Only reads the file schemas.
+        """
+        if samples is None:
+            samples = self.samples
+        columns = {}
+        for s in samples:
+            schema = pq.read_schema(self.path(s))
+            index = schema.pandas_metadata["index_columns"]
+            for c in schema.names:
+                if c not in index:
+                    columns[c] = True
+        return list(columns)
+
+    def read(self, samples=None, columns=None):
+        """Read the results for some or all samples.
+
+        Arguments
+        ---------
+        samples : list of str, optional
+            The samples to read. Defaults to all samples.
+        columns : list of str, optional
+            The columns to read. Defaults to all columns.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The combined results.
+        """
+        if samples is None:
+            samples = self.samples
+        dfs = [self._read(s, columns) for s in samples]
+        return pd.concat(dfs, sort=False)
+
+    def _read(self, sample, columns):
+        """Read a single sample, columns missing in the file will be NA."""
+        if columns is None:
+            return pd.read_parquet(self.path(sample))
+        names = pq.read_schema(self.path(sample)).names
+        df = pd.read_parquet(
+            self.path(sample), columns=[c for c in columns if c in names]
+        )
+        return df.reindex(columns=columns)
+
+    def combine(self, filename, samples, **kwargs):
+        """Write results to a single CSV file one sample at a time.
+
+        Only the given samples are written, so shards left over from
+        earlier runs are ignored. Columns missing in some samples are
+        filled with NA like in `pandas.concat`. Additional arguments are
+        passed to `pandas.DataFrame.to_csv`.
+        """
+        samples = [s for s in samples if isfile(self.path(s))]
+        columns = self.columns(samples)
+        self._write_csv(filename, samples, columns, "wt", **kwargs)
+        return columns
+
+    def _write_csv(self, filename, samples, columns, mode, **kwargs):
+        """Write or append samples to a CSV file."""
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, mode) as out:
+            if len(samples) == 0 and mode == "wt":
+                pd.DataFrame(columns=columns).to_csv(out, **kwargs)
+            for i, s in enumerate(samples):
+                df = pd.read_parquet(self.path(s)).reindex(columns=columns)
+                df.to_csv(out, header=(i == 0 and mode == "wt"), **kwargs)
+
+    def _signature(self, sample):
+        st = os.stat(self.path(sample))
+        return [st.st_size, st.st_mtime_ns]
+
+    def merge(self, filename, samples, **kwargs):
+        """Fold new or changed samples into a combined CSV file.
+
+        Keeps a manifest of the merged samples next to the CSV file. New
+        samples are appended if they do not add any columns. Changed or
+        removed samples and new columns require rewriting the file, which
+        is still done one sample at a time.
+
+        Returns
+        -------
+        list of str
+            The samples that were written to the file.
+        """
+        manifest_file = filename + ".manifest.json"
+        samples = [s for s in samples if isfile(self.path(s))]
+        current = {s: self._signature(s) for s in samples}
+        manifest = None
+        if isfile(filename) and isfile(manifest_file):
+            with open(manifest_file) as f:
+                manifest = json.load(f)
+        if manifest is not None:
+            merged = manifest["samples"]
+            new = [s for s in samples if s not in merged]
+            unchanged = all(current.get(s) == sig for s, sig in merged.items())
+            columns = manifest["columns"]
+            added = set(self.columns(new)) - set(columns)
+            if unchanged and len(added) == 0:
+                self._write_csv(filename, new, columns, "at", **kwargs)
+                merged.update((s, current[s]) for s in new)
+                self._save_manifest(manifest_file, merged, columns)
+                return new
+        columns = self.combine(filename, samples, **kwargs)
+        self._save_manifest(manifest_file, current, columns)
+        return samples
+
+    def _save_manifest(self, filename, samples, columns):
+        with open(filename, "w") as out:
+            json.dump({"samples": samples, "columns": columns}, out)
+
+
+class FluxStore(ResultStore):
+    """Non-zero fluxes in long format, one Parquet file per sample.
+
+    Every file has the columns "sample", "compartment", "reaction" and
+    "flux". The first three are categorical and their categories contain
+    all compartments and reactions of the sample's community, including
+    the ones without any flux.
+    """
+
+    def write(self, sample, fluxes):
+        """Save the non-zero fluxes of a sample.
+
+        Arguments
+        ---------
+        sample : str
+            The sample name.
+        fluxes : pandas.DataFrame
+            The fluxes with one row per compartment and one column per
+            reaction as returned by micom. A "sample" column is ignored.
+        """
+        fluxes = fluxes.drop(columns="sample", errors="ignore")
+        values = fluxes.values
+        rows, cols = np.nonzero(np.nan_to_num(values))
+        df = pd.DataFrame(
+            {
+                "sample": pd.Categorical.from_codes(
+                    np.zeros(len(rows), dtype=int), [sample]
+                ),
+                "compartment": pd.Categorical.from_codes(
+                    rows, fluxes.index.astype(str)
+                ),
+                "reaction": pd.Categorical.from_codes(
+                    cols, fluxes.columns.astype(str)
+                ),
+                "flux": values[rows, cols],
+            }
+        )
+        return ResultStore.write(self, sample, df)
+
+    def _categories(self, sample, column):
+        """Get the categories of a column without reading the others."""
+        df = pd.read_parquet(self.path(sample), columns=[column])
+        return df[column].cat.categories
+
+    def compartments(self, samples=None):
+        """Get all compartments for some or all samples."""
+        if samples is None:
+            samples = self.samples
+        comps = [
+            pd.DataFrame(
+                {
+                    "sample": s,
+                    "compartment": self._categories(s, "compartment"),
+                }
+            )
+            for s in samples
+        ]
+        if len(comps) == 0:
+            return pd.DataFrame(columns=["sample", "compartment"])
+        return pd.concat(comps, ignore_index=True)
+
+    def query(
+        self,
+        samples=None,
+        prefix=None,
+        suffix=None,
+        compartments=None,
+        exclude=None,
+    ):
+        """Read a subset of the fluxes.
+
+        Reaction IDs are matched against the reaction categories of one
+        sample at a time and all filters are applied while reading the
+        Parquet files, so only the matching fluxes are loaded.
+
+        Arguments
+        ---------
+        samples : list of str, optional
+            The samples to read. Defaults to all samples.
+        prefix, suffix : str, optional
+            Only read reactions whose IDs start or end with those strings.
+        compartments : list of str, optional
+            Only read fluxes in those compartments.
+        exclude : list of str, optional
+            Skip fluxes in those compartments.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The non-zero fluxes in long format. Has no rows if nothing
+            matches.
+        """
+        if samples is None:
+            samples = self.samples
+        filters = []
+        if compartments is not None:
+            filters.append(("compartment", "in", list(compartments)))
+        if exclude is not None:
+            filters.append(("compartment", "not in", list(exclude)))
+        dfs = []
+        for s in samples:
+            sample_filters = list(filters)
+            if prefix is not None or suffix is not None:
+                reactions = self._categories(s, "reaction")
+                keep = np.ones(len(reactions), dtype=bool)
+                if prefix is not None:
+                    keep &= reactions.str.startswith(prefix)
+                if suffix is not None:
+                    keep &= reactions.str.endswith(suffix)
+                if not keep.any():
+                    continue
+                sample_filters.append(
+                    ("reaction", "in", list(reactions[keep]))
+                )
+            dfs.append(
+                pd.read_parquet(self.path(s), filters=sample_filters or None)
+            )
+        if len(dfs) == 0:
+            df = pd.DataFrame(
+                columns=["sample", "compartment", "reaction", "flux"]
+            ).astype({"flux": float})
+        else:
+            df = pd.concat(dfs, ignore_index=True)
+        for col in ["sample", "compartment", "reaction"]:
+            df[col] = df[col].astype(str).astype("category")
+        return df
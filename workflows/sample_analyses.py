@@ -0,0 +1,109 @@
+"""Run tradeoff, minimal media and knockout analyses in a single pass.
+
+Every community is only loaded once and all analyses are run on the
+loaded model in the same worker. Knockouts for large communities are split
+into separate tasks so they do not hold up the end of the run.
+
+When run by Snakemake only the sample given by the wildcard is analyzed and
+the combined tables are assembled by the merge rules. Samples that fail in
+all attempts get no results at all, so Snakemake fails their job and runs
+them again the next time.
+"""
+
+from os import remove
+from os.path import isfile
+import pandas as pd
+import micom
+from model_store import load_community
+from analyses import (
+    tradeoff_grid,
+    tradeoff_rates,
+    media_and_gcs,
+    knockouts,
+    knockout_tasks,
+    task_id,
+    collect_knockouts,
+)
+from media_cache import cache_options
+from results import FluxStore, ResultStore
+from pool import pool_options, run, run_name
+
+
+logger = micom.logger.logger
+logger.add("micom.log")
+try:
+    max_procs = snakemake.threads
+    config = snakemake.config
+    tradeoffs = tradeoff_grid(snakemake.config.get("tradeoff_step", 0.1))
+    chunk_size = snakemake.config.get("knockout_chunk", 8)
+    samples = [snakemake.wildcards.sample]
+except NameError:
+    max_procs = 20
+    config = {}
+    tradeoffs = tradeoff_grid()
+    chunk_size = 8
+    samples = pd.read_csv("data/recent.csv").run_accession.tolist()
+if max_procs == 1:
+    chunk_size = float("inf")
+logger.info("Using %d threads..." % max_procs)
+
+outputs = {
+    "tradeoff": "data/tradeoff.csv",
+    "knockouts": "data/knockouts.csv",
+    "gcs": "data/growth_rates.csv",
+    "medium": "data/minimal_imports.csv",
+}
+stores = {
+    name: ResultStore(out.split(".")[0]) for name, out in outputs.items()
+}
+parts = ResultStore("data/knockouts/parts")
+sparse_fluxes = FluxStore("data/fluxes")
+
+
+def analyze_sample(task):
+    """Run the per-sample analyses for a single community.
+
+    Tasks are tuples (kind, sample, taxa). "all" runs all analyses,
+    "sample" skips the knockouts and "knockout" only knocks out the
+    given taxa.
+    """
+    kind, sam, taxa = task
+    com = load_community(sam)
+    if kind == "knockout":
+        parts.write(task_id((sam, taxa)), knockouts(com, sam, taxa))
+        return
+    stores["tradeoff"].write(sam, tradeoff_rates(com, sam, tradeoffs))
+    media = media_and_gcs(com, sam, **cache_options(config))
+    for name in ["gcs", "medium"]:
+        stores[name].write(sam, media[name])
+    sparse_fluxes.write(sam, media["fluxes"])
+    if kind == "all":
+        stores["knockouts"].write(sam, knockouts(com, sam))
+
+
+ko_tasks = knockout_tasks(samples, chunk_size)
+split = set(sam for sam, taxa in ko_tasks if taxa is not None)
+tasks = [("sample" if sam in split else "all", sam, None) for sam in samples]
+tasks += [("knockout", s, taxa) for s, taxa in ko_tasks if taxa is not None]
+run(
+    analyze_sample,
+    tasks,
+    max_procs,
+    name=run_name("sample_analyses", samples),
+    **pool_options(config)
+)
+collect_knockouts(parts, stores["knockouts"], ko_tasks)
+all_stores = list(stores.values()) + [sparse_fluxes]
+for sam in samples:
+    done = [isfile(store.path(sam)) for store in all_stores]
+    if all(done):
+        continue
+    # partial results would mark the sample as done
+    logger.error("analyses failed for %s, no results are saved." % sam)
+    for store, exists in zip(all_stores, done):
+        if exists:
+            remove(store.path(sam))
+if len(samples) > 1:
+    for name, out in outputs.items():
+        stores[name].merge(out, samples)
+    sparse_fluxes.merge("data/minimal_fluxes.csv.gz", samples, index=False)
@@ -0,0 +1,256 @@
+"""Helpers for solving sequences of closely related community problems."""
+
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import micom
+from cobra.util.solver import interface_to_str
+from optlang.interface import OPTIMAL
+from micom.problems import regularize_l2_norm
+from micom.solution import (
+    CommunitySolution,
+    solve,
+    crossover,
+    optimize_with_retry,
+)
+from micom.util import (
+    _format_min_growth,
+    _apply_min_growth,
+    check_modification,
+)
+import pool
+
+logger = micom.logger.logger
+
+# Simplex methods can reuse the previous optimal basis after bounds changed,
+# barrier methods (the micom default) always start from scratch.
+warm_methods = {
+    "cplex": {"lp_method": "dual", "qp_method": "primal"},
+    "gurobi": {"lp_method": "dual"},
+}
+
+# Solver settings for retries of failed tasks. The first attempt keeps the
+# micom defaults. Retries skip the warm starts, so the second attempt runs
+# the barrier methods from scratch with relaxed tolerances and the third one
+# switches to the primal simplex.
+fallbacks = [
+    {},
+    {"tolerance": 1e-5, "convergence": 1e-7},
+    {"tolerance": 1e-5, "lp_method": "primal", "qp_method": "primal"},
+]
+
+
+def get_basis(com):
+    """Get the current simplex basis or None if not supported."""
+    interface = interface_to_str(com.solver.interface)
+    problem = com.solver.problem
+    try:
+        if interface == "cplex":
+            return problem.solution.basis.get_basis()
+        if interface == "gurobi":
+            return (
+                problem.getAttr("VBasis", problem.getVars()),
+                problem.getAttr("CBasis", problem.getConstrs()),
+            )
+    except Exception:
+        logger.info("no basis available for %s." % com.id)
+    return None
+
+
+def set_basis(com, basis):
+    """Use a previously obtained basis as start for the next solve.
+
+    Does nothing in retries of failed tasks, which solve from scratch.
+    """
+    if basis is None or pool.attempt > 0:
+        return
+    interface = interface_to_str(com.solver.interface)
+    problem = com.solver.problem
+    if interface == "cplex":
+        problem.start.set_start(basis[0], basis[1], [], [], [], [])
+    elif interface == "gurobi":
+        problem.setAttr("VBasis", problem.getVars(), basis[0])
+        problem.setAttr("CBasis", problem.getConstrs(), basis[1])
+
+
+def use_fallback(com, attempt):
+    """Apply the solver settings for the given attempt of a task."""
+    settings = fallbacks[min(attempt, len(fallbacks) - 1)]
+    if len(settings) == 0:
+        return com
+    logger.info("using solver settings %s for %s." % (settings, com.id))
+    interface = interface_to_str(com.solver.interface)
+    config = com.solver.configuration
+    if "tolerance" in settings:
+        config.tolerances.feasibility = settings["tolerance"]
+        config.tolerances.optimality = settings["tolerance"]
+    if "convergence" in settings:
+        if interface == "cplex":
+            com.solver.problem.parameters.barrier.convergetol.set(
+                settings["convergence"]
+            )
+        elif interface == "gurobi":
+            com.solver.problem.Params.BarConvTol = settings["convergence"]
+    for option in ["lp_method", "qp_method"]:
+        if option not in settings:
+            continue
+        try:
+            setattr(config, option, settings[option])
+        except (AttributeError, ValueError):
+            logger.info("solver %s does not support %s." % (interface, option))
+    return com
+
+
+@contextmanager
+def warm_start(com):
+    """Switch the solver to methods that reuse the previous solution.
+
+    The original solver configuration is restored on exit. Retries of
+    failed tasks keep the methods of their fallback settings instead.
+    """
+    if pool.attempt > 0:
+        logger.info("no warm start for %s in a retry." % com.id)
+        yield com
+        return
+    interface = interface_to_str(com.solver.interface)
+    config = com.solver.configuration
+    old = {}
+    for option, value in warm_methods.get(interface, {}).items():
+        try:
+            old[option] = getattr(config, option)
+            setattr(config, option, value)
+        except (AttributeError, ValueError):
+            logger.info("solver %s does not support %s." % (interface, option))
+    advance = None
+    if interface == "cplex":
+        advance = com.solver.problem.parameters.advance
+        old_advance = advance.get()
+        advance.set(1)
+    try:
+        yield com
+    finally:
+        for option, value in old.items():
+            setattr(config, option, value)
+        if advance is not None:
+            advance.set(old_advance)
+
+
+def tradeoff_sweep(com, fractions, fluxes=False, include_max=False):
+    """Run cooperative tradeoff for several fractions as one problem.
+
+    The L2 regularized problem is only set up once. Fractions are visited
+    in descending order so that every solve starts from the optimal basis of
+    the neighbouring fraction. This gives the same results as
+    `Community.cooperative_tradeoff` with a list of fractions.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community to optimize.
+    fractions : array-like of floats in [0, 1]
+        The fractions of the maximal community growth rate to enforce.
+    fluxes : boolean
+        Whether to return fluxes in the solutions.
+    include_max : boolean
+        Whether to prepend the solution maximizing community growth with
+        a tradeoff of NaN.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A data frame with columns "tradeoff" and "solution".
+
+    """
+    with com, warm_start(com):
+        check_modification(com)
+        _apply_min_growth(com, _format_min_growth(0.0, com.species))
+        com.objective = 1000.0 * com.variables.community_objective
+        max_growth = (
+            optimize_with_retry(com, "could not get community growth rate.")
+            / 1000.0
+        )
+        results = []
+        if include_max:
+            results.append((np.nan, CommunitySolution(com, slim=not fluxes)))
+
+        regularize_l2_norm(com, 0.0)
+        for fr in np.sort(fractions)[::-1]:
+            com.variables.community_objective.lb = fr * max_growth
+            com.variables.community_objective.ub = max_growth
+            sol = solve(com, fluxes=fluxes, pfba=False)
+            if sol.status != OPTIMAL:
+                logger.info("tradeoff %g not optimal, crossing over." % fr)
+                sol = crossover(com, sol, fluxes=fluxes)
+            results.append((fr, sol))
+    return pd.DataFrame.from_records(
+        results, columns=["tradeoff", "solution"]
+    )
+
+
+def knockout_taxa(com, taxa=None, fraction=1.0):
+    """Knock out taxa one at a time starting from the wild-type solution.
+
+    Works like `Community.knockout_species` with method "change". The
+    optimal bases of the wild-type problems are saved and every knockout
+    starts from them instead of solving from scratch.
+
+    Arguments
+    ---------
+    com : micom.Community
+        The community to use.
+    taxa : list of str, optional
+        The taxa to knock out. Defaults to all taxa in the community.
+    fraction : float in [0, 1]
+        Percentage of the maximum community growth rate that has to be
+        maintained.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The changes in growth rates with one row for each knockout and one
+        column for each taxon.
+
+    """
+    if taxa is None:
+        taxa = com.species
+    growth = com.variables.community_objective
+    with com, warm_start(com):
+        check_modification(com)
+        _apply_min_growth(com, _format_min_growth(0.0, com.species))
+        with com:
+            com.objective = 1000.0 * growth
+            max_growth = (
+                optimize_with_retry(com, "could not get community growth.")
+                / 1000.0
+            )
+            lp_basis = get_basis(com)
+        regularize_l2_norm(com, fraction * max_growth)
+        growth.ub = max_growth
+        old = com.optimize().members["growth_rate"]
+        qp_basis = get_basis(com)
+
+        results = []
+        for sp in taxa:
+            with com:
+                logger.info("getting growth rates for %s knockout." % sp)
+                for r in com.reactions.query(lambda ri: ri.community_id == sp):
+                    r.knock_out()
+                growth.lb = 0.0
+                growth.ub = None
+                with com:
+                    com.objective = 1000.0 * growth
+                    set_basis(com, lp_basis)
+                    max_growth = (
+                        optimize_with_retry(
+                            com, "could not get community growth."
+                        )
+                        / 1000.0
+                    )
+                growth.lb = fraction * max_growth
+                growth.ub = max_growth
+                set_basis(com, qp_basis)
+                sol = com.optimize()
+                if sol.status != OPTIMAL:
+                    sol = crossover(com, sol)
+                results.append(sol.members["growth_rate"] - old)
+    return pd.DataFrame(results, index=taxa).drop("medium", axis=1)
@@ -1,13 +1,13 @@
 import pandas as pd
-import micom
+from catalog import load_catalog
 
 keep = [
     "samples",
-    "kingdom_y",
-    "phylum_y",
-    "class_y",
-    "order_y",
-    "family_y",
+    "kingdom",
+    "phylum",
+    "class",
+    "order",
+    "family",
     "genus",
     "species",
     "oxygenstat",
@@ -18,30 +18,30 @@ keep = [
     "file",
     "reads",
     "relative",
-    "taxa_id_y",
+    "taxa_id",
 ]
 
-
-def reduce_group(df):
-    new = df.iloc[0, :]
-    new["file"] = "|".join(df.id.apply(lambda id: f"{id}.xml"))
-    return new
-
-
-agora = micom.data.agora
-agora = agora.rename(columns={"mclass": "class", "superkingdom": "kingdom"})
-agora = (
-    agora.groupby(["genus", "species"])
-    .apply(reduce_group)
-    .reset_index(drop=True)
-)
-
-
-species = pd.read_csv("data/abundances.csv")
-species.species = species.species.str.split(" ").str[1]
-species.taxa_id = species.taxa_id.str.replace("*", "").astype("int")
-
-species_models = pd.merge(species, agora, on=["genus", "species"])
-species_models = species_models.rename(columns={"id_x": "samples"})[keep]
-species_models.columns = species_models.columns.str.replace("_y", "")
-species_models.to_csv("data/species.csv", index=False)
+try:
+    chunk_size = snakemake.config.get("abundance_chunk", 1000000)
+except NameError:
+    chunk_size = 1000000
+
+agora = load_catalog("species").drop(columns="id")
+
+# Assign models one chunk at a time and append them to the output
+header = True
+for chunk in pd.read_csv(
+    "data/abundances.csv",
+    usecols=["id", "genus", "species", "reads", "relative"],
+    chunksize=chunk_size,
+):
+    chunk = chunk.rename(columns={"id": "samples"})
+    chunk["species"] = chunk.species.str.split(" ").str[1]
+    species_models = chunk.join(agora, on=["genus", "species"], how="inner")
+    species_models[keep].to_csv(
+        "data/species.csv",
+        index=False,
+        header=header,
+        mode="w" if header else "a",
+    )
+    header = False
@@ -1,48 +1,52 @@
 """Calculate stats for taxa assignments and availability in AGORA."""
 
 import pandas as pd
-import micom
+from catalog import lineages
 
-
-tax = pd.read_csv("data/abundances.csv").query("kingdom == 'Bacteria'")
-tax.relative = tax.groupby("id").relative.apply(lambda a: a / a.sum())
-tax.taxa_id = tax.taxa_id.str.replace("*", "").astype("int")
-agora = micom.data.agora
-agora.species = agora.genus + " " + agora.species
 taxa = ["kingdom", "phylum", "class", "order", "family", "genus", "species"]
 
+tax = pd.read_csv(
+    "data/abundances.csv", usecols=["id", "relative"] + taxa
+).query("kingdom == 'Bacteria'")
+tax.relative = tax.relative / tax.groupby("id").relative.transform("sum")
+
+
+def taxa_stats(taxonomy, ranks, lineages):
+    """Get assignment and model coverage stats for all ranks at once.
 
-def taxa_stats(taxonomy, rank, agora):
-    res = pd.Series(
-        index=[
-            "n_unique",
-            "mean_percent_assigned",
-            "sd_percent_assigned",
-            "n_model",
-            "mean_percent_model",
-            "sd_percent_model",
-        ]
+    Percentages are summarized over the samples that have at least one
+    assigned taxon (or taxon with a model) on the respective rank.
+    """
+    values = taxonomy[ranks]
+    masks = pd.concat(
+        {
+            "assigned": values.notna(),
+            "model": pd.DataFrame(
+                {r: values[r].isin(lineages[r]) for r in ranks}
+            ),
+        },
+        axis=1,
     )
-    assigned = taxonomy.dropna(subset=[rank]).groupby("id").relative.sum()
-    if rank == "superkingdom":
-        arank = "kingdom"
-    elif rank == "class":
-        arank = "mclass"
-    else:
-        arank = rank
-    good = taxonomy[rank].isin(agora[arank].dropna())
-    has_model = taxonomy[good].groupby("id").relative.sum()
-    res.iloc[:] = [
-        taxonomy[rank].nunique(),
-        assigned.mean(),
-        assigned.std(),
-        taxonomy[good][rank].nunique(),
-        has_model.mean(),
-        has_model.std(),
-    ]
-    res.name = rank
-    return res
-
-
-stats = pd.concat([taxa_stats(tax, ta, agora) for ta in taxa], axis=1)
+    per_sample = pd.concat(
+        {
+            "percent": masks.mul(taxonomy.relative, axis=0),
+            "n": masks.astype(int),
+        },
+        axis=1,
+    )
+    per_sample = per_sample.groupby(taxonomy.id.values).sum()
+    percent = per_sample["percent"].where(per_sample["n"] > 0)
+    return pd.DataFrame(
+        {
+            "n_unique": values.nunique(),
+            "mean_percent_assigned": percent["assigned"].mean(),
+            "sd_percent_assigned": percent["assigned"].std(),
+            "n_model": values.where(masks["model"]).nunique(),
+            "mean_percent_model": percent["model"].mean(),
+            "sd_percent_model": percent["model"].std(),
+        }
+    ).T
+
+
+stats = taxa_stats(tax, taxa, lineages(taxa))
 print(stats)
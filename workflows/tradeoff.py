@@ -1,48 +1,39 @@
 """Get growth rates over a variety of tradeoffs."""
 
 import micom
-from micom import load_pickle
-from micom.workflows import workflow
-import numpy as np
+from model_store import load_community
 import pandas as pd
+from analyses import tradeoff_grid, tradeoff_rates
+from results import ResultStore
+from pool import pool_options, run, run_name
 
 
-tradeoffs = np.arange(0.1, 1.01, 0.1)
 logger = micom.logger.logger
 logger.add("micom.log")
 try:
     max_procs = snakemake.threads
+    config = snakemake.config
+    tradeoffs = tradeoff_grid(snakemake.config.get("tradeoff_step", 0.1))
 except NameError:
     max_procs = 20
+    config = {}
+    tradeoffs = tradeoff_grid()
 logger.info("Using %d threads..." % max_procs)
 
+rates = ResultStore("data/tradeoff")
+
 
 def growth_rates(sam):
-    com = load_pickle("data/models/" + sam + ".pickle")
-    sol = com.optimize()
-    rates = sol.members
-    rates["tradeoff"] = np.nan
-    rates["sample"] = sam
-    df = [rates]
-
-    # Get growth rates
-    try:
-        sol = com.cooperative_tradeoff(fraction=tradeoffs)
-    except Exception as e:
-        logger.warning("Sample %s could not be optimized\n %s" % (sam, str(e)))
-        return pd.DataFrame(
-            {"tradeoff": tradeoffs, "growth_rate": np.nan, "sample": sam}
-        )
-    for i, s in enumerate(sol.solution):
-        rates = s.members
-        rates["tradeoff"] = sol.tradeoff[i]
-        rates["sample"] = sam
-        df.append(rates)
-    df = pd.concat(df)
-    return df
+    com = load_community(sam)
+    rates.write(sam, tradeoff_rates(com, sam, tradeoffs))
 
 
 samples = pd.read_csv("data/recent.csv")
-rates = workflow(growth_rates, samples.run_accession, max_procs)
-rates = pd.concat(rates)
-rates.to_csv("data/tradeoff.csv")
+run(
+    growth_rates,
+    samples.run_accession,
+    max_procs,
+    name=run_name("tradeoff", samples.run_accession),
+    **pool_options(config)
+)
+rates.combine("data/tradeoff.csv", samples.run_accession)
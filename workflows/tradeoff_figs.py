@@ -1,58 +1,53 @@
 import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 from plotnine import *
 from mizani.formatters import percent_format
 from matplotlib.ticker import LogFormatterMathtext
 import joypy as jp
-from scipy.stats import spearmanr, pearsonr
+from correlation import grouped_correlation
+import figure_data
 
 theme_set(theme_minimal())
+try:
+    max_procs = snakemake.threads
+    method = snakemake.config.get("correlation", "pearson")
+    bootstrap = snakemake.config.get("bootstrap", 1000)
+except NameError:
+    max_procs = 20
+    method = "pearson"
+    bootstrap = 1000
+
+rates = figure_data.rates()
+rates["tradeoff"] = rates.tradeoff_label
+replication = figure_data.replication()
 
-rates = (
-    pd.read_csv("data/tradeoff.csv")
-    .dropna(subset=["abundance"])
-    .rename(columns={"sample": "id", "compartments": "genus"})
+both = pd.merge(rates, replication, on=["id", "genus"])
+within_samples = grouped_correlation(
+    both,
+    ["tradeoff", "id"],
+    "rate",
+    "growth_rate",
+    method,
+    bootstrap,
+    processes=max_procs,
 )
-rates["tradeoff"] = rates.tradeoff.round(2).astype("str")
-rates.loc[rates.tradeoff == "nan", "tradeoff"] = "none"
-
-replication = (
-    pd.read_csv("data/replication_rates.csv")
-    .query("intercept > 1")
-    .groupby(["id", "genus"])
-    .rate.mean()
-    .reset_index()
+across_samples = grouped_correlation(
+    both,
+    "tradeoff",
+    "rate",
+    "growth_rate",
+    method,
+    bootstrap,
+    processes=max_procs,
 )
-
-
-def corr(df):
-    """Calculates correlations.
-
-    In order to run the analysis with Spearman correlations just substitute
-    `spearmanr` for `pearsonr` here.
-    """
-    if df.shape[0] > 2:
-        return pd.Series(
-            pearsonr(df.rate, df.growth_rate) + (df.shape[0],),
-            index=["rho", "p", "n"],
-        )
-    else:
-        return pd.Series(
-            [np.nan, np.nan, df.shape[0]], index=["rho", "p", "n"]
-        )
-
-
-both = pd.merge(rates, replication, on=["id", "genus"])
-within_samples = both.groupby(["tradeoff", "id"]).apply(corr).reset_index()
-across_samples = both.groupby("tradeoff").apply(corr).reset_index()
+label = method.capitalize() + " rho"
 
 pl = (
     ggplot(within_samples[within_samples.n > 6], aes(x="tradeoff", y="rho"))
     + geom_hline(yintercept=0, linetype="dashed")
     + geom_boxplot(outlier_color="none")
     + geom_jitter(width=0.15, height=0, alpha=0.5, stroke=0)
-    + labs(x="tradeoff", y="Pearson rho")
+    + labs(x="tradeoff", y=label)
 )
 pl.save("figures/within_sample_correlations.svg", width=5, height=5)
 within_samples.to_csv("data/correlation_per_sample.csv")
@@ -60,16 +55,14 @@ within_samples.to_csv("data/correlation_per_sample.csv")
 pl = (
     ggplot(across_samples[across_samples.n > 6], aes(x="tradeoff", y="rho"))
     + geom_hline(yintercept=0, linetype="dashed")
+    + geom_errorbar(aes(ymin="rho_low", ymax="rho_high"), width=0.2)
     + geom_point()
     + geom_line(aes(group=1))
-    + labs(x="tradeoff", y="Pearson rho")
+    + labs(x="tradeoff", y=label)
 )
 pl.save("figures/across_sample_correlations.svg", width=5, height=5)
 across_samples.to_csv("data/correlation_all.csv")
 
-rates["log_rates"] = np.log10(rates.growth_rate)
-rates.loc[rates.growth_rate <= 0, "log_rates"] = -16
-
 fig, axes = jp.joyplot(
     rates, by="tradeoff", column="log_rates", color="cornflowerblue"
 )